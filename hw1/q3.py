@@ -1,40 +1,74 @@
 """Calculates the expected number of cards where ordinal value of the
 card matches their position in a 13-card deck. Also prints the observed
-distribution and compares it to a binomial distribution.""" 
+distribution and compares it to a binomial distribution and to the exact
+distribution, derived from the number of derangements."""
 
-from math import factorial
+from math import comb, factorial
 from random import shuffle
 
-def simulate_matches():
-    deck = list(range(13))
+import numpy as np
+import numpy.random
+
+def simulate_matches(n=13):
+    deck = list(range(n))
     shuffle(deck)
     return sum([i == card for i, card in enumerate(deck)])
 
+def sample_matches(samples, n=13, chunk=100000, rng=None):
+    """Returns the number of shuffles of an n-card deck, out of samples,
+    with each number of matches from 0 to n. Shuffles are drawn chunk at
+    a time, each as the argsort of a row of uniforms, so memory stays
+    bounded however many are drawn."""
+    if rng is None:
+        rng = numpy.random
+    count = np.zeros(n + 1, dtype=np.int64)
+    positions = np.arange(n)
+    for start in range(0, samples, chunk):
+        size = min(chunk, samples - start)
+        decks = np.argsort(rng.random((size, n)), axis=1)
+        matches = (decks == positions).sum(axis=1)
+        count += np.bincount(matches, minlength=n + 1)
+    return count
+
+def derangements(n):
+    """Returns the number of permutations of 0 to n items with no fixed
+    point, by the recurrence D(i) = (i - 1) (D(i - 1) + D(i - 2))."""
+    table = [1, 0]
+    for i in range(2, n + 1):
+        table.append((i - 1) * (table[i - 1] + table[i - 2]))
+    return table[:n + 1]
+
+def match_mass(n, k):
+    """Returns the exact probability that a shuffled n-card deck has k
+    matches: the k matching cards are chosen and the rest deranged."""
+    return comb(n, k) * derangements(n - k)[-1] / factorial(n)
+
 def binomial_mass(n, k, p):
     return (factorial(n) / factorial(n-k) / factorial(k)) * p ** k * (1 - p) ** (n - k)
 
-count = [0]*14
-samples = int(1e6)
-print(f'1/{samples}', end='\r')
-for i in range(samples):
-    if i % 100 == 0:
-        print(f'{i}/{samples}', end='\r')
-    count[simulate_matches()] += 1
-print()
-
-distrib = 0
-expect = 0
-bin_distrib = 0
-print(f'{"N":>3}{"Raw freq":>12}{"Normal":>12}'
-      f'{"Dist":>12}{"Bin dist":>12}')
-print(f'  {"="}  {"="*10}  {"="*10}  {"="*10}  {"="*10}')
-for i, c in enumerate(count):
-    prob = c/samples
-    distrib += prob
-    expect += prob * i
-    bin_prob = binomial_mass(13, i, 1/13)
-    bin_distrib += bin_prob
-    print(f'{i:3}{c:12}{prob: 12.3}{distrib: 12.3}{bin_distrib: 12.3}')
-print(f'Expected value: {expect}')
-print('Alternative expected value:',
-      sum([i*c for i,c in enumerate(count)])/samples)
+def main(samples=int(1e6), n=13):
+    count = sample_matches(samples, n)
+
+    distrib = 0
+    expect = 0
+    bin_distrib = 0
+    exact_distrib = 0
+    print(f'{"N":>3}{"Raw freq":>12}{"Normal":>12}'
+          f'{"Dist":>12}{"Bin dist":>12}{"Exact dist":>12}')
+    print(f'  {"="}  {"="*10}  {"="*10}  {"="*10}  {"="*10}  {"="*10}')
+    for i, c in enumerate(count):
+        prob = c/samples
+        distrib += prob
+        expect += prob * i
+        bin_distrib += binomial_mass(n, i, 1/n)
+        exact_distrib += match_mass(n, i)
+        print(f'{i:3}{c:12}{prob: 12.3}{distrib: 12.3}{bin_distrib: 12.3}'
+              f'{exact_distrib: 12.3}')
+    print(f'Expected value: {expect}')
+    print('Alternative expected value:',
+          sum([i*c for i,c in enumerate(count)])/samples)
+    print('Exact expected value:',
+          sum(i * match_mass(n, i) for i in range(n + 1)))
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,14 @@
 """Simulate a bike share station, reporting the total profit over time T."""
 
 from math import log
+import os
 from random import random
-from queue import PriorityQueue
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             '..', 'project', 'python'))
+# pylint: disable=wrong-import-position
+from des import HeapQueue, Renewal, run
 
 # Client = namedtuple('Client', ['rate', 'fixed_revenue', 'ride_revenue',
 #                                'empty_cost'])
@@ -19,41 +25,32 @@ def poisson(rate):
     return (log(rate) - log(random())) / rate
 
 
-class Event:
+class Event(Renewal):
     """An event, initialized with a random arrival time, according to a
     poisson process and specified rate, and offset from the current
     time."""
-    rate = 1
-    def __init__(self, time):
-        self.time = time + poisson(self.rate)
-
-    def trigger(self, state):
-        """Triggers the event and modifies the current state accordingly."""
+    __slots__ = ()
 
-    def get_next(self):
-        """Create a new event of the same type, occuring some time in
-        the future based on that event's inter-arrival time
-        distribution."""
-        return type(self)(self.time)
-
-    def __lt__(self, other):
-        return self.time < other.time
+    def delay(self):
+        return poisson(self.rate)
 
 
 class Bike(Event):
     """A bike is returned to the station."""
+    __slots__ = ()
     rate = 6
-    def trigger(self, state):
+    def apply(self, state):
         state['num_bikes'] += 1
 
 
 class Rider(Event):
     """A rider arrives looking for a bike."""
+    __slots__ = ()
     fixed_revenue = 0
     ride_revenue = 0
     empty_cost = 0
 
-    def trigger(self, state):
+    def apply(self, state):
         if state['num_bikes']:
             state['num_bikes'] -= 1
             state['revenue'] += self.ride_revenue
@@ -63,6 +60,7 @@ class Rider(Event):
 
 class Rider_1(Rider):
     """An annual subscriber of type 1."""
+    __slots__ = ()
     rate = 3
     fixed_renue = .5
     empty_cost = 1
@@ -70,6 +68,7 @@ class Rider_1(Rider):
 
 class Rider_2(Rider):
     """An annual subscriber of type 2."""
+    __slots__ = ()
     rate = 1
     fixed_renue = .1
     empty_cost = 0.25
@@ -77,6 +76,7 @@ class Rider_2(Rider):
 
 class Rider_3(Rider):
     """A pay-per-ride rider."""
+    __slots__ = ()
     rate = 4
     ride_revenue = 1.25
 
@@ -88,11 +88,11 @@ def profit(time, state):
     return (Rider_1.rate * Rider_1.fixed_revenue + Rider_2.rate *
             Rider_2.fixed_revenue) * time + state['revenue'] - state['cost']
 
-def print_event(time, event, state):
+def print_event(event, state):
     """Print the time and result of a single event."""
-    print(f'{time:6.2f}  {type(event).__name__:12}'
+    print(f'{event.time:6.2f}  {type(event).__name__:12}'
           f' no. bikes: {state["num_bikes"]: 2}'
-          f' profit: {profit(time, state)}')
+          f' profit: {profit(event.time, state)}')
 
 def simulate(interval=T, verbose=False):
     """Perform one simulation and return the final profit."""
@@ -103,25 +103,16 @@ def simulate(interval=T, verbose=False):
             'cost': 0
             }
 
-    # store future events in a priority queue, so that the event popped
-    # off the queue will always be the event with the smallest time
-    future_events = PriorityQueue()
+    # store future events in a heap, so that the event popped off it
+    # will always be the event with the smallest time
+    future_events = HeapQueue()
     # initialize one upcoming event of each type
     for et in event_types:
-        future_events.put(et(t))
-
-    while True:
-        event = future_events.get()
-        # if the next event happens outside of our interval, stop
-        if event.time > interval:
-            break
-        t = event.time
-        # trigger the event, updating the state accordingly
-        event.trigger(state)
-        if verbose:
-            print_event(t, event, state)
-        # initialize another event of the same type
-        future_events.put(event.get_next())
+        future_events.push(et(t))
+
+    # trigger events, each followed by another of the same type, until
+    # the next event happens outside of our interval
+    run(future_events, state, interval, print_event if verbose else None)
 
     if verbose:
         print(f'Final profit: {profit(interval, state)}')
@@ -1,27 +1,30 @@
 """Simulate a bike share station, using a merged poisson process,
-reporting the total profit over time T."""
+reporting the total profit over time T.
 
-from math import exp, factorial
-from random import random
-from sys import float_info
+The arrivals of every type together form one poisson process, with the
+sum of their rates, so a run draws the number of events in the interval
+from a single poisson distribution, and the type of each event, in
+order, independently with probability proportional to its rate. Both
+draws are made from tables, built once per interval and event types."""
+
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             '..', 'project', 'python'))
+# pylint: disable=wrong-import-position
+from sampler import AliasTable, PoissonTable
+
+T = 120
+INITIAL_BIKES = 10
 
 class Event:
-    """An event, initialized with a random arrival time, according to a
-    poisson process and specified rate, and offset from the current
-    time."""
+    """An event of a poisson process with a specified rate."""
     rate = 0
 
     def trigger(self, state):
         """Triggers the event and modifies the current state accordingly."""
 
-    def get_next(self):
-        """Create a new event of the same type, occuring some time in
-        the future based on that event's inter-arrival time
-        distribution."""
-        return type(self)(self.time)
-
-    def __lt__(self, other):
-        return self.time < other.time
 
 class Bike(Event):
     """A bike is returned to the station."""
@@ -47,14 +50,14 @@ class Rider(Event):
 class Rider_1(Rider):
     """An annual subscriber of type 1."""
     rate = 3
-    fixed_renue = .5
+    fixed_revenue = .5
     empty_cost = 1
 
 
 class Rider_2(Rider):
     """An annual subscriber of type 2."""
     rate = 1
-    fixed_renue = .1
+    fixed_revenue = .1
     empty_cost = 0.25
 
 
@@ -65,38 +68,42 @@ class Rider_3(Rider):
 
 event_types = [Bike, Rider_1, Rider_2, Rider_3]
 
-def build_cdf_table(event_types, time):
-    """Returns a list of CDF values, where each entry is equal to
-    F(i)."""
-    table = []
-    rate = sum(e.rate for e in event_types)
-    prob = exp(-rate * time)
-    cumulative = 0
-    k = 0
-    while prob < float_info.epsilon:
-        table.append(0)
-        prob = exp(-rate * time) * 
-    while 1 - cumulative > 0.1:
-        print(k, f'{cumulative:.6f}')
-        cumulative += prob
-        table.append(cumulative)
-        prob = rate * time * prob / (k + 1)
-        k += 1
-    print(rate)
-    return table
-
-def get_total_events(cdf_table):
-    u = random()
-    for k, c in enumerate(cdf_table):
-        if c > u:
-            return k - 1
-    raise RuntimeError
-
-def simulate(interval):
-    cdf_table = build_cdf_table(event_types, interval)
-    total_events = get_total_events(cdf_table)
-    print(total_events)
-
-simulate(53)
-
+def profit(time, state):
+    """Calculate the current profit (including aggregate membership
+    revenue, per-ride revenue, and penalty costs)."""
+    return (Rider_1.rate * Rider_1.fixed_revenue + Rider_2.rate *
+            Rider_2.fixed_revenue) * time + state['revenue'] - state['cost']
 
+def build_tables(event_types, time, rng=None):
+    """Returns a table of the distribution of the total number of events
+    in an interval of length time, and an alias table of the type of
+    each event."""
+    rate = sum(e.rate for e in event_types)
+    return (PoissonTable(rate * time, rng),
+            AliasTable([e.rate for e in event_types], rng))
+
+def simulate(interval=T, verbose=False, rng=None):
+    """Perform one simulation and return the final profit."""
+    totals, types = build_tables(event_types, interval, rng)
+    events = [et() for et in event_types]
+    state = {
+            'num_bikes': INITIAL_BIKES,
+            'revenue': 0,
+            'cost': 0
+            }
+    total_events = totals.sample()
+    for k in types.sample(total_events).tolist():
+        events[k].trigger(state)
+
+    if verbose:
+        print(f'Total events: {total_events}')
+        print(f'Final profit: {profit(interval, state)}')
+    return profit(interval, state)
+
+def main(runs=5000):
+    mean = 0
+    for _ in range(runs):
+        mean += simulate() / runs
+    print(f'Average profit: {mean:.3f}')
+if __name__ == '__main__':
+    main()
@@ -1,22 +1,40 @@
-"""Simulate an algorithm to find the zero of a function as a Markov chain."""
+"""Simulate an algorithm to find the zero of a function as a Markov chain.
+
+From state j, the chain moves to k, for k from 1 to j - 1, with
+probability 2k/j^2, and to 0 otherwise. The probability of moving to k
+or above is (j^2 - j - k^2 + k)/j^2, so the next state is the largest k
+with k(k - 1) <= j(j - 1) - u j^2 for a uniform u: a root of a quadratic,
+found in constant time rather than by a search down from j - 1. The same
+inversion advances an ensemble of chains, as an array, one step at a
+time until every chain is absorbed."""
 # pylint: disable=invalid-name
 
-from math import log
+from math import ceil, log, sqrt
 from random import random
-from statistics import mean, variance
+
+import numpy as np
+import numpy.random
 
 def sample_k(j):
     """Generate a value for k, given j, according to specified
     probabilities."""
-    u = random()
-    k = j - 1
-    cdf = 2 * k / j**2
-    while k > 0:
-        if u <= cdf:
-            return k
-        k -= 1
-        cdf += 2 * k / j**2
-    return 0
+    c = j * (j - 1) - random() * j**2
+    # j need not be an integer, in which case neither are the states
+    # between it and 0
+    k = (j - 1) - ceil((j - 1) - (1 + sqrt(max(1 + 4 * c, 0))) / 2)
+    k = min(k, j - 1)
+    # k(k - 1) falls again below k = 1/2, so a state under the larger
+    # root can still be too small, and then only 0 is left
+    return k if k > 0 and k * (k - 1) <= c else 0
+
+def sample_ks(j, rng=None):
+    """Generate a value for k for each value of j in an array."""
+    if rng is None:
+        rng = numpy.random
+    c = j * (j - 1) - rng.random(j.shape) * j**2
+    root = (1 + np.sqrt(np.maximum(1 + 4 * c, 0))) / 2
+    k = np.minimum((j - 1) - np.ceil((j - 1) - root), j - 1)
+    return np.where((k > 0) & (k * (k - 1) <= c), k, 0)
 
 def simulate(m):
     """Simulate a zero-finding algorithm and return the total number of
@@ -27,30 +45,45 @@ def simulate(m):
         m = sample_k(m)
     return i
 
+def simulate_ensemble(m, chains, rng=None):
+    """Simulate a zero-finding algorithm from m in chains independent
+    chains at once, and return an array of the number of iterations
+    each performed."""
+    state = np.full(chains, m, dtype=float)
+    iterations = np.zeros(chains, dtype=np.int64)
+    active = np.arange(chains)
+    while active.size:
+        iterations[active] += 1
+        state[active] = sample_ks(state[active], rng)
+        active = active[state[active] != 0]
+    return iterations
+
 def replicate(iterations, m):
     """Perform a batch of simulations and report both their mean and
     their standard deviation."""
-    results = [simulate(m) for _ in range(iterations)]
-    return mean(results), variance(results)
+    results = simulate_ensemble(m, iterations)
+    return results.mean(), results.var(ddof=1)
 
 def find_expected(confidence=.05, iterations=100, m=1000):
-    means = []
-    variances = []
-    perror = 1
-    i = 0
-    while perror > confidence:
-        i += 1
-        mu, S = replicate(iterations, m)
-        means.append(mu)
-        variances.append(S)
-        perror = (mean(variances)) / (i * iterations)
-        print(mean(means), perror)
-    return mean(means), mean(variances) / (i * iterations)
-
-m = 3**8/2
-iterations = 100
-confidence = 0.01
-result, confidence = find_expected(confidence, iterations, m)
-print(result, confidence)
-print(2 * log(m, 3) - result)
-print(log(m, 2) - result)
+    """Simulate until the variance of the mean number of iterations is
+    within confidence, and return the mean and that variance. After a
+    first batch of iterations simulations, each further batch is sized
+    from the sample variance to reach confidence."""
+    results = simulate_ensemble(m, iterations)
+    while True:
+        perror = results.var(ddof=1) / results.size
+        print(results.mean(), perror)
+        if perror <= confidence:
+            return results.mean(), perror
+        needed = ceil(results.var(ddof=1) / confidence) - results.size
+        results = np.concatenate(
+                [results, simulate_ensemble(m, max(needed, iterations))])
+
+if __name__ == '__main__':
+    m = 3**8/2
+    iterations = 100
+    confidence = 0.01
+    result, confidence = find_expected(confidence, iterations, m)
+    print(result, confidence)
+    print(2 * log(m, 3) - result)
+    print(log(m, 2) - result)
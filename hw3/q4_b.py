@@ -1,78 +1,236 @@
-"""Calculate expected time until absorption for models 1 and 2."""
+"""Calculate expected time until absorption for models 1 and 2.
 
-from math import log
-from queue import PriorityQueue
+In both models, contacts between pairs of individuals occur at a given
+rate in the whole population, and a contact between an infected and a
+healthy individual transmits the infection with a given probability. In
+model 2, every infected individual also recovers at a given rate, and
+can be infected again. Model 1 has no recovery, and is absorbed once
+everyone is infected; model 2 is absorbed once no one is.
+
+simulate() runs the event model one contact and recovery at a time.
+gillespie() runs the same continuous time Markov chain by the direct
+method, one change of state at a time, so its cost grows with the
+number of infections and recoveries rather than with contacts or the
+size of the population. ensemble() runs many replications of the
+direct method at once, as arrays, and tau_leap() advances them in fixed
+steps of time, drawing the infections and recoveries of a step from
+poisson distributions, for populations where even the changes of state
+are too many to simulate one at a time."""
+
+from math import inf, log, sqrt
+import os
 from random import random
+import sys
+
+import numpy as np
+import numpy.random
 
-CONTACT_RATE = 0
-INFECTION_PROBABILITY = 0
-RECOVERY_RATE = 0
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             '..', 'project', 'python'))
+# pylint: disable=wrong-import-position
+from des import Event, HeapQueue, Renewal, run
+
+CONTACT_RATE = 50
+INFECTION_PROBABILITY = .5
+RECOVERY_RATE = 1
 N = 100
+INITIAL_INFECTED = 1
 
 def arrival(rate):
     """Return a random arrival time based on a rate."""
     return log(1 - random()) / -rate
 
-class Event:
-    """An event, initialized with a random arrival time, according to a
-    poisson process and specified rate, and offset from the current
-    time."""
-    rate = 0
-    def __init__(self, time):
-        self.time = time + arrival(self.rate)
-
-    def trigger(self, state):
-        """Triggers the event and modifies the current state accordingly."""
-
-    def get_next(self):
-        """Create a new event of the same type, occuring some time in
-        the future based on that event's inter-arrival time
-        distribution."""
-        return type(self)(self.time)
+def infection_rate(total, infected, contact_rate=CONTACT_RATE,
+                   infection_probability=INFECTION_PROBABILITY):
+    """Return the rate of infection with a number infected: the rate of
+    contacts times the probability that a contact is between an infected
+    and a healthy individual and transmits the infection."""
+    return (2 * contact_rate * infection_probability * infected
+            * (total - infected) / (total * (total - 1)))
 
-    def __lt__(self, other):
-        return self.time < other.time
+def absorbed(total, infected, recovery_rate=RECOVERY_RATE):
+    """Return whether the model can no longer change state."""
+    return (infected == 0) | ((recovery_rate == 0) & (infected == total))
 
-class Contact(Event):
+class Contact(Renewal):
     """A contact between two individuals in the population. Could result
     in transmission of the infection, if one of the individuals is
     infected and the other is healthy."""
+    __slots__ = ()
     rate = CONTACT_RATE
 
-    def trigger(self, state):
+    def delay(self):
+        return arrival(self.rate)
+
+    def apply(self, state):
         u = random()
         infect = u < ((2 * INFECTION_PROBABILITY * state['infected'] *
                       (state['total'] - state['infected'])) /
                       (state['total'] * (state['total'] - 1)))
         if infect:
             state['infected'] += 1
+            if state['recovery_rate']:
+                state['events'].push(Recovery(
+                        self.time + arrival(state['recovery_rate'])))
         return infect
 
-def simulate(verbose=False):
-    """Perform one simulation and return the final profit."""
+    def trigger(self, state):
+        # no contact follows absorption, so that the simulation ends
+        # once the last recovery, if any, has triggered
+        if absorbed(state['total'], state['infected'],
+                    state['recovery_rate']):
+            return None
+        self.apply(state)
+        if absorbed(state['total'], state['infected'],
+                    state['recovery_rate']):
+            state['absorbed'] = self.time
+            return None
+        return self.get_next()
+
+class Recovery(Event):
+    """The recovery of an infected individual, scheduled an exponential
+    time after their infection."""
+    __slots__ = ()
+
+    def trigger(self, state):
+        state['infected'] -= 1
+        if not state['infected']:
+            state['absorbed'] = self.time
+
+def print_event(event, state):
+    """Print the time and result of a single event."""
+    print(f'{event.time:8.3f}  {type(event).__name__:10}'
+          f' infected: {state["infected"]: 4}')
+
+def simulate(total=N, infected=INITIAL_INFECTED,
+             recovery_rate=RECOVERY_RATE, verbose=False):
+    """Perform one simulation and return the time until absorption."""
     t = 0
+    # store future events in a heap, so that the event popped off it
+    # will always be the event with the smallest time
+    future_events = HeapQueue()
     state = {
-            'total': N,
-            'infected': 0,
+            'total': total,
+            'infected': infected,
+            'recovery_rate': recovery_rate,
+            'absorbed': (t if absorbed(total, infected, recovery_rate)
+                         else None),
+            'events': future_events,
             }
+    future_events.push(Contact(t))
+    if recovery_rate:
+        for _ in range(infected):
+            future_events.push(Recovery(t + arrival(recovery_rate)))
+
+    # trigger events until the model is absorbed and no events remain
+    run(future_events, state, observe=print_event if verbose else None)
+
+    if verbose:
+        print(f'Absorbed at: {state["absorbed"]}')
+    return state['absorbed']
 
-    # store future events in a priority queue, so that the event popped
-    # off the queue will always be the event with the smallest time
-    future_events = PriorityQueue()
-    future_events.put(Contact())
+def gillespie(total=N, infected=INITIAL_INFECTED, contact_rate=CONTACT_RATE,
+              infection_probability=INFECTION_PROBABILITY,
+              recovery_rate=RECOVERY_RATE, horizon=inf, rng=None):
+    """Simulate the model by the direct method and return the time until
+    absorption, or inf if it is not absorbed by horizon."""
+    if rng is None:
+        rng = numpy.random
     t = 0
+    while not absorbed(total, infected, recovery_rate):
+        birth = infection_rate(total, infected, contact_rate,
+                               infection_probability)
+        rate = birth + recovery_rate * infected
+        t += rng.exponential(1 / rate)
+        if t > horizon:
+            return inf
+        infected += 1 if rng.random() * rate < birth else -1
+    return t
 
-    while True:
-        event = future_events.get()
-        # if the next event happens outside of our interval, stop
-        t = event.time
-        # trigger the event, updating the state accordingly
-        event.trigger(state)
-        if verbose:
-            print_event(t, event, state)
-        # initialize another event of the same type
-        future_events.put(event.get_next())
+def ensemble(replications, total=N, infected=INITIAL_INFECTED,
+             contact_rate=CONTACT_RATE,
+             infection_probability=INFECTION_PROBABILITY,
+             recovery_rate=RECOVERY_RATE, horizon=inf, rng=None):
+    """Simulate replications of the model by the direct method, all at
+    once, and return an array of their times until absorption, inf for
+    those not absorbed by horizon."""
+    if rng is None:
+        rng = numpy.random
+    state = np.full(replications, infected, dtype=np.int64)
+    time = np.zeros(replications)
+    active = np.flatnonzero(~absorbed(total, state, recovery_rate))
+    while active.size:
+        i = state[active]
+        birth = infection_rate(total, i, contact_rate,
+                               infection_probability)
+        rate = birth + recovery_rate * i
+        time[active] += rng.exponential(1 / rate)
+        state[active] += np.where(rng.random(active.size) * rate < birth,
+                                  1, -1)
+        late = time[active] > horizon
+        time[active[late]] = inf
+        active = active[~late & ~absorbed(total, state[active],
+                                          recovery_rate)]
+    return time
 
-    if verbose:
-        # print(f'Final profit: {profit(interval, state)}')
-    # return profit(interval, state)
+def tau_leap(replications, total=N, infected=INITIAL_INFECTED,
+             contact_rate=CONTACT_RATE,
+             infection_probability=INFECTION_PROBABILITY,
+             recovery_rate=RECOVERY_RATE, tau=.01, horizon=inf, rng=None):
+    """Simulate replications of the model in steps of tau, all at once,
+    and return an array of their times until absorption, each the end of
+    the step in which it was absorbed, or inf if not absorbed by
+    horizon. Infections and recoveries over a step are drawn from
+    poisson distributions at the rates at its start, and the number
+    infected is kept between 0 and total."""
+    if rng is None:
+        rng = numpy.random
+    state = np.full(replications, infected, dtype=np.int64)
+    time = np.zeros(replications)
+    active = np.flatnonzero(~absorbed(total, state, recovery_rate))
+    t = 0
+    while active.size and t < horizon:
+        t += tau
+        i = state[active]
+        births = rng.poisson(infection_rate(total, i, contact_rate,
+                                            infection_probability) * tau)
+        deaths = rng.poisson(recovery_rate * i * tau)
+        state[active] = np.clip(i + births - deaths, 0, total)
+        done = absorbed(total, state[active], recovery_rate)
+        time[active[done]] = t
+        active = active[~done]
+    time[active] = inf
+    return time
+
+def report(name, times):
+    """Print the mean time until absorption with its standard error."""
+    print(f'{name:30} {times.mean():10.3f} '
+          f'+/- {times.std(ddof=1) / sqrt(times.size):.3f}')
+
+def main(replications=2000):
+    for model, recovery_rate in ((1, 0), (2, RECOVERY_RATE)):
+        print(f'Model {model}, N = {N}')
+        report('event simulation',
+               np.array([simulate(recovery_rate=recovery_rate)
+                         for _ in range(replications)]))
+        report('direct method',
+               np.array([gillespie(recovery_rate=recovery_rate)
+                         for _ in range(replications)]))
+        report('direct method ensemble',
+               ensemble(replications, recovery_rate=recovery_rate))
+        report('tau leaping',
+               tau_leap(replications, recovery_rate=recovery_rate))
+    # with contacts scaled with the population, so that every individual
+    # has as many contacts in any size of population
+    for total in (10**4, 10**6):
+        contact_rate = CONTACT_RATE * total / N
+        print(f'Model 1, N = {total}')
+        report('direct method', np.array([
+                gillespie(total, contact_rate=contact_rate, recovery_rate=0)
+                for _ in range(10)]))
+        report('tau leaping', tau_leap(
+                replications, total, contact_rate=contact_rate,
+                recovery_rate=0))
+
+if __name__ == '__main__':
+    main()
@@ -1,50 +1,50 @@
 """Simulate a bike share station, reporting the total profit over time T."""
 
-from math import log
-from random import random
+import os
 from statistics import variance, mean
-from queue import PriorityQueue
+import sys
 
+import numpy as np
+import numpy.random
 from numpy.random import exponential
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             '..', 'project', 'python'))
+# pylint: disable=wrong-import-position
+from des import HeapQueue, Renewal, run
+
 T = 120
 INITIAL_BIKES = 10
+# bikes at the station at the start, each equally likely, for stratified
+# estimates
+STARTING_BIKES = tuple(range(5, 16))
 
-class Event:
+class Event(Renewal):
     """An event, initialized with a random arrival time, according to a
     poisson process and specified rate, and offset from the current
     time."""
-    rate = 1
-    def __init__(self, time):
-        self.time = time + exponential(1 / self.rate)
-
-    def trigger(self, state):
-        """Triggers the event and modifies the current state accordingly."""
+    __slots__ = ()
 
-    def get_next(self):
-        """Create a new event of the same type, occuring some time in
-        the future based on that event's inter-arrival time
-        distribution."""
-        return type(self)(self.time)
-
-    def __lt__(self, other):
-        return self.time < other.time
+    def delay(self):
+        return exponential(1 / self.rate)
 
 
 class Bike(Event):
     """A bike is returned to the station."""
+    __slots__ = ()
     rate = 6
-    def trigger(self, state):
+    def apply(self, state):
         state['num_bikes'] += 1
 
 
 class Rider(Event):
     """A rider arrives looking for a bike."""
+    __slots__ = ()
     fixed_revenue = 0
     ride_revenue = 0
     empty_cost = 0
 
-    def trigger(self, state):
+    def apply(self, state):
         if state['num_bikes']:
             state['num_bikes'] -= 1
             state['revenue'] += self.ride_revenue
@@ -54,6 +54,7 @@ class Rider(Event):
 
 class Rider_1(Rider):
     """An annual subscriber of type 1."""
+    __slots__ = ()
     rate = 3
     fixed_revenue = .5
     empty_cost = 1
@@ -61,6 +62,7 @@ class Rider_1(Rider):
 
 class Rider_2(Rider):
     """An annual subscriber of type 2."""
+    __slots__ = ()
     rate = 1
     fixed_revenue = .1
     empty_cost = 0.25
@@ -68,6 +70,7 @@ class Rider_2(Rider):
 
 class Rider_3(Rider):
     """A pay-per-ride rider."""
+    __slots__ = ()
     rate = 4
     ride_revenue = 1.25
 
@@ -79,11 +82,11 @@ def profit(time, state):
     return (Rider_1.rate * Rider_1.fixed_revenue + Rider_2.rate *
             Rider_2.fixed_revenue) * time + state['revenue'] - state['cost']
 
-def print_event(time, event, state):
+def print_event(event, state):
     """Print the time and result of a single event."""
-    print(f'{time:6.2f}  {type(event).__name__:12}'
+    print(f'{event.time:6.2f}  {type(event).__name__:12}'
           f' no. bikes: {state["num_bikes"]: 2}'
-          f' profit: {profit(time, state)}')
+          f' profit: {profit(event.time, state)}')
 
 def simulate(interval=T, verbose=False):
     """Perform one simulation and return the final profit."""
@@ -94,25 +97,16 @@ def simulate(interval=T, verbose=False):
             'cost': 0
             }
 
-    # store future events in a priority queue, so that the event popped
-    # off the queue will always be the event with the smallest time
-    future_events = PriorityQueue()
+    # store future events in a heap, so that the event popped off it
+    # will always be the event with the smallest time
+    future_events = HeapQueue()
     # initialize one upcoming event of each type
     for et in event_types:
-        future_events.put(et(t))
-
-    while True:
-        event = future_events.get()
-        # if the next event happens outside of our interval, stop
-        if event.time > interval:
-            break
-        t = event.time
-        # trigger the event, updating the state accordingly
-        event.trigger(state)
-        if verbose:
-            print_event(t, event, state)
-        # initialize another event of the same type
-        future_events.put(event.get_next())
+        future_events.push(et(t))
+
+    # trigger events, each followed by another of the same type, until
+    # the next event happens outside of our interval
+    run(future_events, state, interval, print_event if verbose else None)
 
     if verbose:
         print(f'Final profit: {profit(interval, state)}')
@@ -120,21 +114,145 @@ def simulate(interval=T, verbose=False):
     # return state['revenue']
     return profit(interval, state)
 
+def simulate_batch(runs, interval=T, rng=None, chunk=1000,
+                   initial=INITIAL_BIKES, return_counts=False):
+    """Perform many simulations at once, starting with initial bikes,
+    and return an array of their final profits. If return_counts is
+    true, also return an array of the number of events of each type in
+    every run, with a column for each of event_types.
+
+    The four event types are independent poisson processes, so together
+    they form one poisson process with the summed rate, in which each
+    event is of a given type with probability proportional to its rate.
+    Profit depends only on the order of events, not their times, so
+    each run draws its number of events in the interval and then their
+    types. The number of bikes is a random walk, up one for every bike
+    and down one for every rider, held at zero: a rider finds the
+    station empty exactly when the unheld walk reaches a new low below
+    zero."""
+    rng = numpy.random if rng is None else rng
+    rates = np.array([et.rate for et in event_types], dtype=float)
+    total = rates.sum()
+    step = np.array([1 if et is Bike else -1 for et in event_types] + [0])
+    revenue = np.array([getattr(et, 'ride_revenue', 0)
+                        for et in event_types] + [0])
+    cost = np.array([getattr(et, 'empty_cost', 0)
+                     for et in event_types] + [0])
+    profits = np.empty(runs)
+    type_counts = np.empty((runs, len(event_types)), dtype=np.int64)
+    for start in range(0, runs, chunk):
+        size = min(chunk, runs - start)
+        counts = rng.poisson(total * interval, size)
+        width = counts.max()
+        types = rng.choice(len(event_types), (size, width), p=rates / total)
+        # pad every run to the same number of events with a type that
+        # does nothing
+        types[np.arange(width) >= counts[:, np.newaxis]] = len(event_types)
+        moves = step[types]
+        walk = initial + np.cumsum(moves, axis=1)
+        low = np.minimum.accumulate(np.minimum(walk, 0), axis=1)
+        empty = low < np.concatenate([np.zeros((size, 1), dtype=low.dtype),
+                                      low[:, :-1]], axis=1)
+        riding = (moves < 0) & ~empty
+        state = {'revenue': (revenue[types] * riding).sum(axis=1),
+                 'cost': (cost[types] * empty).sum(axis=1)}
+        profits[start:start + size] = profit(interval, state)
+        if return_counts:
+            # one bincount over all runs, offset so that every run has
+            # its own bins
+            offset = (len(event_types) + 1) * np.arange(size)[:, np.newaxis]
+            type_counts[start:start + size] = np.bincount(
+                    (types + offset).ravel(),
+                    minlength=(len(event_types) + 1) * size).reshape(
+                            size, -1)[:, :len(event_types)]
+    if return_counts:
+        return profits, type_counts
+    return profits
+
+def control_variates(samples, controls, means):
+    """Estimate the mean of samples with controls, an array with a
+    column for each control variate, whose means are known. The
+    coefficients are fitted by least squares, and the estimate is the
+    sample mean less their combination of the controls' deviations from
+    their means. Returns the estimate, its variance and the sample
+    variance of samples divided by the variance of the residuals, the
+    factor by which the controls reduce the variance."""
+    samples = np.asarray(samples, dtype=float)
+    controls = np.asarray(controls, dtype=float)
+    deviations = controls - controls.mean(axis=0)
+    beta = np.linalg.lstsq(deviations, samples - samples.mean(),
+                           rcond=None)[0]
+    residuals = samples - deviations @ beta
+    estimate = samples.mean() - (controls.mean(axis=0) - means) @ beta
+    # the fitted coefficients cost a degree of freedom each
+    dof = samples.size - 1 - controls.shape[1]
+    residual_variance = ((residuals - residuals.mean())**2).sum() / dof
+    return (estimate, residual_variance / samples.size,
+            samples.var(ddof=1) / residual_variance)
+
+def estimate_profit(runs=500, interval=T, initial=(INITIAL_BIKES,),
+                    weights=None, controls=None, rng=None):
+    """Estimate the mean profit when the station starts with each of
+    initial bikes with probability weights (equal by default), by
+    stratified sampling on the initial bikes, with runs allocated to
+    strata in proportion to their weights, and the counts of arrivals of
+    each of controls (all event types by default) as control variates
+    within each stratum. Returns the estimate, its variance and the
+    factor by which the variance is reduced from that of the mean of as
+    many runs with randomly drawn initial bikes."""
+    if weights is None:
+        weights = np.ones(len(initial))
+    weights = np.asarray(weights, dtype=float) / np.sum(weights)
+    if controls is None:
+        controls = event_types
+    columns = [event_types.index(et) for et in controls]
+    means = np.array([et.rate * interval for et in controls])
+    sizes = np.maximum(np.rint(weights * runs).astype(int), 2 + len(columns))
+    estimate = estimate_variance = 0
+    stratum_means, stratum_variances = [], []
+    for bikes, weight, size in zip(initial, weights, sizes):
+        samples, counts = simulate_batch(size, interval, rng, initial=bikes,
+                                         return_counts=True)
+        theta, v, _reduction = control_variates(samples, counts[:, columns],
+                                                means)
+        estimate += weight * theta
+        estimate_variance += weight**2 * v
+        stratum_means.append(samples.mean())
+        stratum_variances.append(samples.var(ddof=1))
+    # the variance of one run with initial bikes drawn at random, by
+    # the law of total variance
+    stratum_means = np.array(stratum_means)
+    crude_variance = (weights @ np.array(stratum_variances)
+                      + weights @ (stratum_means - weights @ stratum_means)**2)
+    return (estimate, estimate_variance,
+            crude_variance / sizes.sum() / estimate_variance)
+
 def calculate_cost(interval, initial):
     return ((Rider_1.rate + Rider_2.rate + Rider_3.rate - Bike.rate) *
             interval - initial) * (Rider_1.empty_cost * Rider_1.rate / 8
                                    + Rider_2.empty_cost * Rider_2.rate /
                                    8)
 
-def main(runs=5000):
-    samples = [simulate() for _ in range(runs)]
-    mean_revenue = mean(samples)
+def main(runs=5000, batch=True):
+    if batch:
+        samples = simulate_batch(runs).tolist()
+    else:
+        samples = [simulate() for _ in range(runs)]
     v = variance(samples)
-    profit = (Rider_1.rate * Rider_1.fixed_revenue + Rider_2.rate *
-              Rider_2.fixed_revenue) * T + (mean_revenue -
-                                            calculate_cost(T,INITIAL_BIKES))
-    print(f'Average profit: {profit:.3f}')
-    print(v)
-    # print(mean_cost)
+    print(f'Average profit ({runs} runs, {INITIAL_BIKES} bikes): '
+          f'{mean(samples):.3f} +/- {1.96 * (v / runs)**.5:.3f}')
+    estimate, v, reduction = estimate_profit(runs // 10)
+    print(f'Average profit with control variates ({runs // 10} runs, '
+          f'{INITIAL_BIKES} bikes): {estimate:.3f} +/- {1.96 * v**.5:.3f}')
+    print(f'Variance reduction: {reduction:.1f}x, as precise as '
+          f'{reduction * (runs // 10):.0f} runs')
+    estimate, v, reduction = estimate_profit(runs // 10,
+                                             initial=STARTING_BIKES)
+    print(f'Average profit with control variates, stratified '
+          f'({runs // 10} runs, {STARTING_BIKES[0]} to '
+          f'{STARTING_BIKES[-1]} bikes): '
+          f'{estimate:.3f} +/- {1.96 * v**.5:.3f}')
+    print(f'Variance reduction: {reduction:.1f}x, as precise as '
+          f'{reduction * (runs // 10):.0f} runs')
 if __name__ == '__main__':
     main()
@@ -0,0 +1,198 @@
+"""Simulate many replications of a bus route in lockstep.
+
+Every replication of the B35 scenario runs the same fleet over the same
+stop topology, so rather than walking an object graph once per
+replication, the batch engine keeps the state of R replications in
+NumPy arrays and advances all of them one event at a time. At each step
+every replication processes its own earliest pending event, and all of
+the random variates needed for that step are drawn in one call per
+distribution."""
+
+import numpy as np
+import pandas as pd
+
+from simulation import Model, Bus
+from setup import generate_bus_route
+
+
+def route_arrays(routes):
+    """Returns arrays of passenger rates, destination probabilities,
+    distances and traffic distributions for a list of routes, indexed
+    by route and then by stop."""
+    arrays = [route.arrays() for route in routes]
+    return (np.stack([a.passenger_rate for a in arrays]),
+            np.stack([a.destination_proba for a in arrays]),
+            np.stack([a.distance_to for a in arrays]),
+            np.stack([a.traffic_to for a in arrays]))
+
+
+def simulate_batch(replications=40, duration=300, model=None,
+                   fleet_size=12, headway=15, route_seed=None):
+    """Run a number of independent replications of the two-way B35
+    scenario together, returning one row of statistics per replication
+    with the same columns as Stats.report(). If a route_seed is given,
+    every replication runs on the same cached pair of routes.
+
+    Every step costs about the same whatever the number of replications,
+    so the time per replication falls as more run together: for the
+    12-hour B35 scenario, 200 replications take a tenth of the time per
+    replication of simulate(), but 40 only about a quarter."""
+    if model is None:
+        model = Model()
+    capacity = Bus().capacity
+    rng = model.rng
+    R, K, B = replications, 2, 2 * fleet_size
+    rows_all = np.arange(R)
+
+    # route topology, one generated pair of routes per replication
+    seeds = [None if route_seed is None else (route_seed, k)
+             for k in range(K)]
+    worlds = [route_arrays([generate_bus_route(model, 12444, 31, 6.7, seed)
+                            for seed in seeds])
+              for _ in range(R)]
+    rate, proba, distance, traffic = (np.stack(a) for a in zip(*worlds))
+    S = rate.shape[2]
+    waiting = np.zeros((R, K, S), dtype=np.int64)
+    emptied = np.zeros((R, K, S))
+    schedule = np.arange(0, duration * 2, headway, dtype=float)
+    # the first fleet_size trips on each route are taken by the buses
+    # starting on it; buses beyond the schedule start at 0, as in
+    # simulate()
+    first_trips = min(fleet_size, schedule.size)
+    next_slot = np.full((R, K), first_trips)
+
+    # fleet state, one column per bus; the first fleet_size buses start
+    # on route 0 and the rest on route 1
+    route = np.repeat(np.arange(K), fleet_size)[np.newaxis].repeat(R, 0)
+    stop = np.zeros((R, B), dtype=np.int64)
+    arriving = np.ones((R, B), dtype=bool)
+    load = np.zeros((R, B), dtype=np.int64)
+    carried = np.zeros((R, B), dtype=np.int64)
+    stamp = np.zeros((R, B))
+    passenger_time = np.zeros((R, B))
+    start = np.zeros(fleet_size)
+    start[:first_trips] = schedule[:first_trips]
+    start = np.tile(start, (R, K))
+    time = start + travel_time(model, distance[:, route[0], 0],
+                               traffic[:, route[0], 0],
+                               rng.standard_normal((R, B)))
+
+    # statistics
+    total_time = np.zeros(R)
+    total_passengers = np.zeros(R)
+    completions = np.zeros(R)
+    last_completion = np.zeros(R)
+    trip_lengths = np.zeros(R)
+    trips = np.zeros(R)
+    leaps = np.zeros(R)
+    last_bus = np.zeros((R, K))
+
+    # flat views for cheap one-dimensional indexing: buses by
+    # row * B + column, stops by (row * K + route) * S + stop
+    flat = {name: a.reshape(-1) for name, a in (
+        ('time', time), ('route', route), ('stop', stop),
+        ('arriving', arriving), ('load', load), ('carried', carried),
+        ('stamp', stamp), ('passenger_time', passenger_time),
+        ('start', start), ('rate', rate), ('proba', proba),
+        ('waiting', waiting), ('emptied', emptied))}
+    distance = distance.reshape(-1)
+    traffic = traffic.reshape(-1, 2)
+
+    active = np.ones(R, dtype=bool)
+    while True:
+        rows = rows_all[active]
+        bus = rows * B + time[rows].argmin(axis=1)
+        finished = flat['start'][bus] >= duration
+        if finished.any():
+            active[rows[finished]] = False
+            rows, bus = rows[~finished], bus[~finished]
+            if not rows.size:
+                break
+        t = flat['time'][bus]
+        k = flat['route'][bus]
+        s = flat['stop'][bus]
+        arrival = flat['arriving'][bus]
+        place = (rows * K + k) * S + s
+
+        # elapse time for passengers on the bus
+        on_board = flat['load'][bus]
+        flat['passenger_time'][bus] += (t - flat['stamp'][bus]) * on_board
+        flat['stamp'][bus] = t
+
+        # unload (arrivals only) and then board everyone waiting
+        unloaded = rng.binomial(on_board,
+                                np.where(arrival, flat['proba'][place], 0))
+        on_board -= unloaded
+        elapsed = np.maximum(0, t - flat['emptied'][place])
+        queue = (rng.poisson(flat['rate'][place] * elapsed)
+                 + flat['waiting'][place])
+        boarded = np.minimum(queue, capacity - on_board)
+        flat['load'][bus] = on_board + boarded
+        flat['carried'][bus] += boarded
+        flat['waiting'][place] = queue - boarded
+        flat['emptied'][place] = t
+
+        # arrivals at the end of a route are recorded after triggering
+        end = arrival & (s == S - 1)
+        if end.any():
+            r, b, te, ke = rows[end], bus[end], t[end], k[end]
+            total_time[r] += flat['passenger_time'][b]
+            total_passengers[r] += flat['carried'][b]
+            flat['passenger_time'][b] = 0
+            flat['carried'][b] = 0
+            first = ke == 0
+            completions[r[first]] += 1
+            last_completion[r[first]] = te[first]
+            trip_lengths[r] += te - flat['start'][b]
+            trips[r] += 1
+            leaps[r] += flat['start'][b] < last_bus[r, ke]
+            last_bus[r, ke] = flat['start'][b]
+
+        # schedule each bus's next event, drawing one normal per bus
+        z = rng.standard_normal(rows.size)
+        dwell = arrival | (boarded > 0)
+        dwell_time = (unloaded * model.unloading_time[0]
+                      + boarded * model.loading_time[0]
+                      + np.sqrt(unloaded * model.unloading_time[1] ** 2
+                                + boarded * model.loading_time[1] ** 2) * z)
+        turn = ~dwell & (s == S - 1)
+        next_k = np.where(turn, (k + 1) % K, k)
+        next_s = np.where(dwell, s, np.where(turn, 0, s + 1))
+        depart = t
+        if turn.any():
+            r, b, nk = rows[turn], bus[turn], next_k[turn]
+            slot = next_slot[r, nk]
+            scheduled = slot < schedule.size
+            slot_time = schedule[np.minimum(slot, schedule.size - 1)]
+            begin = np.where(scheduled, np.maximum(t[turn], slot_time),
+                             t[turn])
+            next_slot[r, nk] += scheduled
+            flat['start'][b] = begin
+            depart = t.copy()
+            depart[turn] = begin
+        ahead = (rows * K + next_k) * S + next_s
+        travel = depart + travel_time(model, distance[ahead],
+                                      traffic[ahead], z)
+        flat['time'][bus] = np.where(dwell, t + dwell_time, travel)
+        flat['arriving'][bus] = ~dwell
+        flat['route'][bus] = next_k
+        flat['stop'][bus] = next_s
+
+    # replications with no completed trips report NaN, as Stats does
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return pd.DataFrame(
+                {'total_time': total_time,
+                 'total_passengers': total_passengers,
+                 'mean_travel_time': total_time / total_passengers,
+                 'total_completions': completions,
+                 'trip_lengths': trip_lengths / trips,
+                 'leaps': leaps,
+                 'mean_wait': last_completion / completions,
+                })
+
+
+def travel_time(model, distance, traffic, z):
+    """Returns travel times for arrays of distances and traffic
+    distributions, given standard normal variates z."""
+    traffic = np.maximum(0, traffic[..., 0] + traffic[..., 1] * z)
+    return distance / model.bus_speed * traffic
@@ -0,0 +1,171 @@
+"""Benchmark the bus simulation engines.
+
+Each case runs a fixed-seed scenario in a fresh worker process and
+reports events per second, replications per second, route setup time
+and the peak resident set size of the worker. Results can be saved as a
+baseline and later runs compared against it; a run fails if any rate
+falls, or any time or memory figure rises, by more than the threshold.
+Times within TIME_RESOLUTION (0.2 ms) of their baseline never fail,
+since route setup now takes about that long.
+
+    python benchmark.py                  # run and compare to baseline
+    python benchmark.py --save           # run and store a new baseline
+    python benchmark.py b35 --replications 5
+"""
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import json
+import os
+import resource
+import sys
+from time import perf_counter
+
+import numpy as np
+
+from bus_route import BATCH_CHUNK, Stats, simulate
+from batch import simulate_batch
+from setup import generate_bus_route
+from simulation import Model
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        'benchmark_baseline.json')
+SEED = 2021
+# routes generated per timing of route setup
+SETUP_REPEATS = 50
+
+# scenario parameters for simulate(); the batch engine only runs the B35,
+# and needs many replications at once to pay off, so its case sets its
+# own number of replications
+CASES = {
+    'b35': dict(duration=720, routes=1, stops=31, passengers=12444,
+                length=6.7, fleet_size=12, headway=15),
+    'b35-batch': dict(duration=720, batch=True, replications=BATCH_CHUNK),
+    'large': dict(duration=180, routes=1, stops=200, passengers=80000,
+                  length=43, fleet_size=250, headway=3),
+    'multi-route': dict(duration=720, routes=8, stops=31, passengers=12444,
+                        length=6.7, fleet_size=12, headway=15),
+}
+
+# higher is better for rates, lower is better for everything else
+RATES = ('events_per_sec', 'replications_per_sec')
+# differences in times (measures in seconds) smaller than this are
+# scheduling noise, whatever their fraction of the baseline: timings of
+# route setup, at 0.2-0.3 ms per route, vary by about 0.15 ms between
+# runs even averaged over SETUP_REPEATS routes
+TIME_RESOLUTION = 2e-4
+
+
+def run_case(name, replications):
+    """Run one benchmark case in the current process and return its
+    measurements."""
+    params = dict(CASES[name])
+    batch = params.pop('batch', False)
+    replications = params.pop('replications', replications)
+    model = Model(rng=np.random.default_rng(SEED))
+    result = {}
+    if batch:
+        start = perf_counter()
+        simulate_batch(replications, params['duration'], model)
+        elapsed = perf_counter() - start
+    else:
+        # route setup takes well under a millisecond, so each timing
+        # covers many routes
+        setup_times = []
+        for _ in range(5):
+            start = perf_counter()
+            for _ in range(SETUP_REPEATS):
+                generate_bus_route(model, params['passengers'],
+                                   params['stops'], params['length'])
+            setup_times.append((perf_counter() - start) / SETUP_REPEATS)
+        result['route_setup_sec'] = min(setup_times)
+        stats = Stats()
+        start = perf_counter()
+        for _ in range(replications):
+            simulate(model=model, stats=stats, **params)
+        elapsed = perf_counter() - start
+        result['events_per_sec'] = stats.events / elapsed
+    result['replications_per_sec'] = replications / elapsed
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    result['peak_rss_mb'] = rss / (2**20 if sys.platform == 'darwin'
+                                   else 2**10)
+    return result
+
+
+def run(names, replications):
+    """Run benchmark cases, each in a fresh process so that peak memory
+    is measured per case."""
+    results = {}
+    for name in names:
+        with ProcessPoolExecutor(1) as executor:
+            results[name] = executor.submit(run_case, name,
+                                            replications).result()
+    return results
+
+
+def regressions(results, baseline, threshold):
+    """Return a list of descriptions of every measurement that is worse
+    than its baseline by more than threshold (a fraction), ignoring
+    times within TIME_RESOLUTION of their baseline."""
+    found = []
+    for name, measures in results.items():
+        for measure, value in measures.items():
+            base = baseline.get(name, {}).get(measure)
+            if not base:
+                continue
+            if (measure.endswith('_sec') and measure not in RATES
+                    and value - base < TIME_RESOLUTION):
+                continue
+            change = (value - base) / base
+            if measure in RATES:
+                change = -change
+            if change > threshold:
+                found.append(f'{name} {measure}: {value:.4g} against '
+                             f'baseline {base:.4g} ({change:+.0%} worse)')
+    return found
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('cases', nargs='*',
+                        help=f'cases to run: {", ".join(CASES)} '
+                        '(default: all)')
+    parser.add_argument('--replications', type=int, default=3)
+    parser.add_argument('--baseline', default=BASELINE)
+    parser.add_argument('--threshold', type=float, default=.2,
+                        help='allowed fractional regression (default .2)')
+    parser.add_argument('--save', action='store_true',
+                        help='store the results as the new baseline')
+    args = parser.parse_args(argv)
+    unknown = set(args.cases) - set(CASES)
+    if unknown:
+        parser.error(f'unknown cases: {", ".join(sorted(unknown))}')
+
+    results = run(args.cases or list(CASES), args.replications)
+    for name, measures in results.items():
+        print(name)
+        for measure, value in measures.items():
+            print(f'  {measure:22}{value:14.4g}')
+
+    if args.save:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        baseline.update(results)
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        return 0
+    if not os.path.exists(args.baseline):
+        print('No baseline to compare against; run with --save.')
+        return 0
+    with open(args.baseline) as f:
+        found = regressions(results, json.load(f), args.threshold)
+    for line in found:
+        print('REGRESSION', line)
+    return 1 if found else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,15 +1,20 @@
 """Simulate a bus route."""
 
-from collections import defaultdict
-from heapq import heappush, heappop
-from statistics import mean
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from math import nan, pi, sqrt, tan
+import os
+from statistics import NormalDist
 
 from numpy import arange
 import numpy as np
 import pandas as pd
 
-from simulation import Model, BusArrival, BusDeparture, Bus
+from simulation import Model, BusArrival, Bus
 from setup import generate_bus_route
+from batch import simulate_batch
+from des import HeapQueue, run
+from streaming import RunningStats
 
 # Consider a simple route with a single bus that travels between 6
 # stops.
@@ -30,190 +35,380 @@ from setup import generate_bus_route
 
 
 class Stats:
-    """Record information about the simulation."""
-    def __init__(self):
+    """Record information about the simulation. Memory use does not grow
+    with the length of the run: trip lengths, headways between
+    completions and mean passenger travel times per trip are kept as
+    running moments with quantile sketches. Headways are measured
+    between completions in the same route direction; if a route name is
+    given, only completions in that direction are counted."""
+    def __init__(self, route=None):
+        self.route = route
         self.total_passengers = 0
         self.total_time = 0
         self.leaps = 0
         self.last_bus = {}
-        self.completions = []
-        self.trip_lengths = []
+        self.last_completion = {}
+        self.headways = RunningStats()
+        self.trip_lengths = RunningStats()
+        self.travel_times = RunningStats()
+        self.events = 0
 
     def record(self, event):
         """Record any relevent information about an event that has just
         triggered."""
+        self.events += 1
         if (isinstance(event, BusArrival)
             and event.stop.route.last == event.stop):
             total_time, total_passengers = event.bus.reset_time()
             self.total_time += total_time
             self.total_passengers += total_passengers
-            if event.stop.route.name == 'B35 E':
-                self.completions.append(event.time)
-                # print(event.bus.name, event.time, event.bus.route_start)
-                # input()
-            self.trip_lengths.append(event.time - event.route_start)
-            last_time = self.last_bus.get(event.stop.route.name, 0)
-            if event.route_start < last_time:
+            if total_passengers:
+                self.travel_times.add(total_time / total_passengers,
+                                      total_passengers)
+            name = event.stop.route.name
+            if self.route is None or name == self.route:
+                self.headways.add(event.time
+                                  - self.last_completion.get(name, 0))
+                self.last_completion[name] = event.time
+            self.trip_lengths.add(event.time - event.route_start)
+            if event.route_start < self.last_bus.get(name, 0):
                 self.leaps += 1
-            self.last_bus[event.stop.route.name] = event.route_start
+            self.last_bus[name] = event.route_start
 
-        # if (isinstance(event, BusArrival)
-        #     and event.stop.route.head == event.stop):
-            # print(f'Starting route at {event.time}')
+    def merge(self, other):
+        """Combine the statistics recorded by another (independent) run
+        into this one."""
+        self.total_passengers += other.total_passengers
+        self.total_time += other.total_time
+        self.leaps += other.leaps
+        self.events += other.events
+        self.headways.merge(other.headways)
+        self.trip_lengths.merge(other.trip_lengths)
+        self.travel_times.merge(other.travel_times)
+        return self
 
     def report(self):
         """Report statistics as a dictionary."""
-        wait_times = []
-        for i, time in enumerate(self.completions):
-            if i == 0:
-                wait_times.append(time)
-            else:
-                wait_times.append(time - self.completions[i-1])
         return pd.Series(
                 {'total_time': self.total_time,
                  'total_passengers': self.total_passengers,
-                 'mean_travel_time': self.total_time / self.total_passengers,
-                 'total_completions': len(self.completions),
-                 'trip_lengths': mean(self.trip_lengths),
+                 'mean_travel_time': (self.total_time / self.total_passengers
+                                      if self.total_passengers else nan),
+                 'total_completions': self.headways.count,
+                 'trip_lengths': self.trip_lengths.mean,
                  'leaps': self.leaps,
-                 'mean_wait': mean(wait_times)
+                 'mean_wait': self.headways.mean
                 })
 
+    def quantiles(self, probs=(.05, .5, .95)):
+        """Report estimated quantiles of trip length, headway and mean
+        passenger travel time per trip."""
+        return pd.DataFrame(
+                {'trip_length': [self.trip_lengths.quantile(q) for q in probs],
+                 'headway': [self.headways.quantile(q) for q in probs],
+                 'travel_time': [self.travel_times.quantile(q) for q in probs]
+                }, index=probs)
 
-def simulate(duration=300, model=None):
+
+# the directions of every route and the buses starting on each direction
+World = namedtuple('World', ['routes', 'fleets'])
+
+
+def build_world(model, routes=1, stops=31, passengers=12444, length=6.7,
+                fleet_size=12, route_seed=None):
+    """Build the two-way routes and the buses of a scenario. Stop demand
+    is drawn from the model, unless a route_seed is given, in which
+    case every world built with that seed shares the same cached
+    demand."""
+    directions = []
+    fleets = []
+    buses = 0
+    for i in range(routes):
+        name = 'B35' if i == 0 else f'Route {i + 1}'
+        seeds = ((None, None) if route_seed is None
+                 else ((route_seed, 2 * i), (route_seed, 2 * i + 1)))
+        route = generate_bus_route(model, passengers, stops, length,
+                                   seeds[0])
+        reverse = generate_bus_route(model, passengers, stops, length,
+                                     seeds[1])
+        route.round = reverse
+        route.name = f'{name} E'
+        reverse.round = route
+        reverse.name = f'{name} W'
+        for direction in (route, reverse):
+            directions.append(direction)
+            fleets.append([Bus(name=f'Bus{buses + j + 1}', rng=model.demand)
+                           for j in range(fleet_size)])
+            buses += fleet_size
+    return World(directions, fleets)
+
+
+def clear_world(world, model):
+    """Return the routes and buses of a World to the state they were
+    built in, drawing from model."""
+    for direction in world.routes:
+        direction.clear(model)
+    for fleet in world.fleets:
+        for bus in fleet:
+            bus.clear(model.demand)
+
+
+def simulate(duration=300, model=None, queue=HeapQueue, stats=None,
+             routes=1, stops=31, passengers=12444, length=6.7,
+             fleet_size=12, headway=15, instruments=None, log=None,
+             route_seed=None, world=None):
     """Run a single simulation, returning the total passenger time and
-    the number of passengers."""
+    the number of passengers. Pending events are kept in a future event
+    list built by queue (HeapQueue or CalendarQueue), and recorded in
+    stats if a Stats is given. If an Instruments is given, events and
+    samplers are counted and timed, and if an EventLog is given, every
+    event is written to it.
+
+    The simulation runs a number of two-way routes, each direction with
+    its own generated stops and a fleet of buses leaving on a fixed
+    headway. The defaults describe the B35. The routes and buses are
+    built by build_world(), or a World from an earlier run can be
+    given, in which case it is cleared and reused and the route
+    parameters are ignored. Unless stats are given, headways are
+    measured on the first route direction only."""
     if model is None:
         model = Model()
-    event_queue = []
-    # route = get_bus_route(model)
-    route = generate_bus_route(model, 12444, 31, 6.7)
-    reverse = generate_bus_route(model, 12444, 31, 6.7)
-    route.round = reverse
-    route.name = 'B35 E'
-    reverse.round = route
-    reverse.name = 'B35 W'
-    fleet = [Bus(name=f'Bus{i+1}') for i in range(12)]
-    reverse_fleet = [Bus(name=f'Bus{i+25}') for i in range(12)]
-    route.schedule = list(arange(0, duration*2, 15))
-    reverse.schedule = list(arange(0, duration*2, 15))
-    buses = []
-    for bus in fleet:
-        buses.append(route.add_bus(model, 0, bus))
-    for bus in reverse_fleet:
-        buses.append(reverse.add_bus(model, 0, bus))
-    stats = Stats()
-
-    done = False
-    i = 0
-    time = 0
-    stop = None
-    seen = set()
-    while buses[i].bus.route_start < duration:
-        if buses[i] is None:
-            continue
-        event = buses[i]
-        if time > event.time and stop == event.stop:
-            print('WARNING: Processing events out of order.')
-            print(event.bus.name, time)
-            print('\n'.join([f'{e}' for e in buses]))
-            input()
-        time = event.time
-        stop = event.stop
-        if event.bus.name in seen:
-            print('WARNING')
-            input()
-        seen.add(event.bus.name)
-
-        next_event = event.trigger(model, None)
-        stats.record(event)
-        while isinstance(next_event, BusDeparture):
-            next_event = next_event.trigger(model, None)
-            stats.record(next_event)
-        buses[i] = next_event
-        h = i
-        j = i - 1 if i > 0 else len(buses) - 1
-        while (next_event.stop == buses[j].stop
-               and next_event.time < buses[j].time):
-            buses[h] = buses[j]
-            buses[j] = next_event
-            h = j
-            j = j - 1 if j > 0 else len(buses) - 1
-        h = i
-        j = i + 1 if i < len(buses) - 1 else 0
-        while (next_event.stop == buses[j].stop
-               and next_event.time > buses[j].time):
-            buses[h] = buses[j]
-            buses[j] = next_event
-            h = j
-            j = j + 1 if j < len(buses) - 1 else 0
-        # buses[i] = event.trigger(model, None)
-        if isinstance(next_event, BusArrival):
-            if i == len(buses) - 1:
-                i = 0
-                seen = set()
-            else:
-                i += 1
-        # print(time)
-
-
-    # for i, bus in enumerate(fleet):
-    #     heappush(event_queue, BusArrival(model, i * 4, bus, route.head))
-    # while event_queue and event_queue[0].time < duration:
-    #     event = heappop(event_queue)
-    #     # print(f'{event}')
-    #     next_event = event.trigger(model, None)
-    #     stats.record(event)
-    #     if next_event is not None:
-    #         heappush(event_queue, next_event)
-        # else:
-        #     heappush(event_queue, BusArrival(model, event.time,
-        #                                      event.bus, route.head))
-    # for stop in route:
-    #     print(stop, stop.total_loads, stop.total_unloads)
-    # print(stats.report())
+    if instruments is not None:
+        model = instruments.wrap_model(model)
+    if world is None:
+        world = build_world(model, routes, stops, passengers, length,
+                            fleet_size, route_seed)
+    else:
+        clear_world(world, model)
+    events = queue()
+    start_buses(world, model, events, duration, [headway] * len(world.routes))
+    if stats is None:
+        stats = Stats(world.routes[0].name)
+    run_events(events, duration, model, stats, instruments, log)
     return stats.report()
-    # return stats.total_time / stats.total_passengers
 
 
-def replicate(iterations=20, duration=60*12, model=None):
-    """Replicates an simulation and returns an array of results."""
-    results = pd.DataFrame([simulate(duration, model) for _ in range(iterations)])
-    return results
+def start_buses(world, model, events, duration, headways):
+    """Schedule trips on every direction of a World on its headway, and
+    push the first arrival of each of its buses onto events."""
+    for direction, fleet, headway in zip(world.routes, world.fleets,
+                                         headways):
+        direction.schedule = list(arange(0, duration*2, headway))
+        for bus in fleet:
+            events.push(direction.add_bus(model, 0, bus))
 
 
-def confidence(means):
-    """Returns a mean with width of confidence interval."""
-    theta = means.mean()
-    confidence = means.transform(np.sort)
-    confidence = confidence.iloc[39] - confidence.iloc[1]
-    # print(confidence)
-    return pd.DataFrame([theta, confidence], index = ['theta', 'confidence'])
-    # theta = mean(means)
-    # means = sorted(means, key=lambda x: (x - theta))
-    # # last = len(means) * .95
-    # # balance = last - int(last)
-    # if len(means) == 1:
-    #     return theta, theta/2
-    # error = means[int(len(means) * .975)] - means[int(len(means) * .025)]
-    # return theta, error
+def run_events(events, duration, model, stats, instruments=None, log=None,
+               until=None):
+    """Trigger events from a future event list in time order, pushing
+    the events that follow them, and record them in stats. Every bus
+    has exactly one pending event; the run stops at the first bus to
+    begin a trip after duration. If until is given, the run pauses
+    before the first event after that time and can be continued by
+    calling run_events again. Returns whether the run is finished."""
+    trigger = observe = None
+    if instruments is None:
+        if log is None:
+            def observe(event, _model):
+                stats.record(event)
+        else:
+            def observe(event, _model):
+                stats.record(event)
+                log.record(event)
+    else:
+        def trigger(event, model):
+            return instruments.step(event, model, stats, len(events))
+        if log is not None:
+            def observe(event, _model):
+                log.record(event)
+    run(events, model, until, observe,
+        lambda event: event.bus.route_start >= duration, trigger)
+    return until is None or not events or events.peek().time <= until
 
 
-def main(model=None):
+# replications per task handed to the batch engine in parallel mode, and
+# per batch of sequential(); every lockstep step costs about the same
+# however many replications share it, and at 200 a replication of the
+# 12-hour B35 takes about a tenth of the time it does in simulate()
+BATCH_CHUNK = 200
+
+
+def run_replications(replications, duration, model, batch):
+    """Run a number of replications, returning a DataFrame of results.
+    This is the unit of work handed to each worker process."""
+    if batch:
+        return simulate_batch(replications, duration, model)
+    return pd.DataFrame([simulate(duration, model)
+                         for _ in range(replications)])
+
+
+def replicate(iterations=20, duration=60*12, model=None, batch=False,
+              workers=None, seed=None):
+    """Replicates an simulation and returns an array of results. If
+    batch is set, all replications are advanced together by the
+    lockstep engine.
+
+    If a seed (an integer or numpy SeedSequence) or a number of worker
+    processes is given, each replication (or each chunk of BATCH_CHUNK
+    replications for the batch engine) draws from its own Generator
+    spawned from the seed, so that results are reproducible and do not
+    depend on the number of workers."""
+    if workers is None and seed is None:
+        return run_replications(iterations, duration, model, batch)
+    if model is None:
+        model = Model()
+    if not isinstance(seed, np.random.SeedSequence):
+        seed = np.random.SeedSequence(seed)
+    size = BATCH_CHUNK if batch else 1
+    sizes = [min(size, iterations - i) for i in range(0, iterations, size)]
+    models = [model.with_rng(np.random.default_rng(child))
+              for child in seed.spawn(len(sizes))]
+    results = map_tasks(run_replications, workers, sizes,
+                        [duration] * len(sizes), models,
+                        [batch] * len(sizes))
+    return pd.concat(results, ignore_index=True)
+
+
+def map_tasks(function, workers, *args):
+    """Map function over argument lists, in a pool of worker processes
+    if more than one worker is requested, returning a list of results
+    in order."""
+    if workers is None or workers == 1:
+        return list(map(function, *args))
+    with ProcessPoolExecutor(workers) as executor:
+        return list(executor.map(function, *args))
+
+
+def t_quantile(p, df):
+    """Returns the p-th quantile of Student's t distribution with df
+    degrees of freedom: exact for one and two degrees of freedom, and
+    otherwise from the Cornish-Fisher expansion about the normal
+    quantile (Abramowitz and Stegun 26.7.5), accurate to about 1% for
+    three degrees of freedom and much better beyond."""
+    if df == 1:
+        return tan(pi * (p - .5))
+    if df == 2:
+        return (2 * p - 1) / sqrt(2 * p * (1 - p))
+    z = NormalDist().inv_cdf(p)
+    terms = [(z**3 + z) / 4,
+             (5*z**5 + 16*z**3 + 3*z) / 96,
+             (3*z**7 + 19*z**5 + 17*z**3 - 15*z) / 384,
+             (79*z**9 + 776*z**7 + 1482*z**5 - 1920*z**3 - 945*z) / 92160]
+    return z + sum(term / df**(i + 1) for i, term in enumerate(terms))
+
+
+def confidence(results, level=.95, method='t', resamples=2000, rng=None):
+    """Returns the mean of each column of results with the half-width of
+    a confidence interval for that mean, either from Student's t
+    distribution or from a percentile bootstrap. Half-widths are NaN
+    for fewer than two rows."""
+    theta = results.mean()
+    n = len(results)
+    if method not in ('t', 'bootstrap'):
+        raise ValueError(f'unknown confidence interval method {method!r}')
+    if n < 2:
+        half_width = pd.Series(nan, index=results.columns)
+    elif method == 't':
+        half_width = (t_quantile((1 + level) / 2, n - 1)
+                      * results.std() / sqrt(n))
+    elif method == 'bootstrap':
+        rng = np.random.default_rng(rng)
+        samples = results.to_numpy()[rng.integers(0, n, (resamples, n))]
+        low, high = np.quantile(samples.mean(axis=1),
+                                [(1 - level) / 2, (1 + level) / 2], axis=0)
+        half_width = pd.Series((high - low) / 2, index=results.columns)
+    return pd.DataFrame([theta, half_width], index=['theta', 'confidence'])
+
+
+def sequential(metric='mean_travel_time', precision=.001, level=.95,
+               batch_size=None, budget=1000, duration=60*12, model=None,
+               batch=False, workers=None, seed=None, method='t',
+               verbose=False):
+    """Adds batches of replications until the confidence interval for
+    the mean of metric has a half-width of at most precision times that
+    mean, or until budget replications have run. Batches are of
+    batch_size replications, by default BATCH_CHUNK for the batch engine,
+    which gains from running many together, and 40 otherwise. Returns
+    the results of every replication and their confidence intervals."""
+    if batch_size is None:
+        batch_size = BATCH_CHUNK if batch else 40
+    if budget < 1:
+        raise ValueError(f'budget must be at least 1, not {budget!r}')
+    if batch_size < 1:
+        raise ValueError(
+                f'batch_size must be at least 1, not {batch_size!r}')
+    if not isinstance(seed, np.random.SeedSequence):
+        seed = np.random.SeedSequence(seed)
+    batches = []
+    replications = 0
+    while True:
+        size = min(batch_size, budget - replications)
+        batches.append(replicate(size, duration, model, batch, workers,
+                                 seed.spawn(1)[0]))
+        replications += size
+        results = pd.concat(batches, ignore_index=True)
+        ci = confidence(results, level, method, rng=seed.spawn(1)[0])
+        theta, half_width = ci[metric]
+        if verbose:
+            print(f'{replications}: {theta:.3f} confidence {half_width:.3f}',
+                  end='\r')
+        if (replications > 1 and half_width <= precision * abs(theta)
+                or replications >= budget):
+            if verbose:
+                print()
+            return results, ci
+
+
+def pair_models(baseline, alternative, seed, antithetic):
+    """Returns the (baseline, alternative) pairs of models run by one
+    paired replication: both drawing common random numbers spawned from
+    seed, and with antithetic set, both again on the mirror image of
+    those streams. The models carry their own generators, so that they
+    can be sent to worker processes."""
+    pairs = [(baseline.with_streams(seed, inversion=antithetic),
+              alternative.with_streams(seed, inversion=antithetic))]
+    if antithetic:
+        pairs.append((baseline.with_streams(seed, antithetic=True),
+                      alternative.with_streams(seed, antithetic=True)))
+    return pairs
+
+
+def run_pair(duration, pairs):
+    """Run pairs of models built by pair_models(), returning the mean
+    difference of their results (alternative minus baseline)."""
+    return sum(simulate(duration, alternative) - simulate(duration, baseline)
+               for baseline, alternative in pairs) / len(pairs)
+
+
+def compare(baseline, alternative, iterations=40, duration=60*12,
+            level=.95, antithetic=False, workers=None, seed=None):
+    """Compare two models using paired replications that share common
+    random numbers, with separate streams for demand, traffic and dwell
+    times. If antithetic is set, each pair is run again on the mirror
+    image of its streams and the two differences averaged. Returns the
+    per-pair differences (alternative minus baseline) and their
+    confidence intervals."""
+    if not isinstance(seed, np.random.SeedSequence):
+        seed = np.random.SeedSequence(seed)
+    pairs = [pair_models(baseline, alternative, child, antithetic)
+             for child in seed.spawn(iterations)]
+    differences = pd.DataFrame(map_tasks(run_pair, workers,
+                                         [duration] * iterations, pairs))
+    return differences, confidence(differences, level)
+
+
+def main(model=None, batch=False, workers=None, seed=None, precision=.001,
+         budget=240):
     pd.options.display.float_format = '{:.3f}'.format
-    for i in range(6):
-        results = replicate(40, model=model)
-        if i:
-            means = (means * i + results) / (i + 1)
-            # for j, (m, r) in enumerate(zip(means, results)):
-            #     means[j] = (m * i + r) / (i + 1)
-        else:
-            means = results
-        ci = confidence(means)
-        print(f'{i}: {ci["mean_travel_time"].iloc[0]:.3f} confidence {ci["mean_travel_time"].iloc[1]:.3f}', end='\r')
-    print(confidence(means))
+    _results, ci = sequential(precision=precision, budget=budget,
+                              model=model, batch=batch, workers=workers,
+                              seed=seed, verbose=True)
+    print(ci)
 
 
 if __name__ == '__main__':
-    main()
-    main(model=Model(loading_time=(1/8, 1/20)))
+    main(workers=os.cpu_count())
+    main(model=Model(loading_time=(1/8, 1/20)), workers=os.cpu_count())
+    _differences, ci = compare(Model(), Model(loading_time=(1/8, 1/20)),
+                               workers=os.cpu_count())
+    print(ci)
@@ -0,0 +1,156 @@
+"""Checkpoint and restore simulations in progress.
+
+A Run holds everything a simulation in progress depends on: the model
+with its random number generators, the routes and buses of its World
+(stop queues, bus loads and schedules), the future event list and the
+Stats. save() writes a Run to a compressed pickle and load() reads it
+back, so that continuing a restored Run follows exactly the trajectory
+the original would have. Runs on the global numpy.random state are
+saved with that state and restore it when loaded.
+
+simulate() runs a simulation, saving it to a file every so many minutes
+of simulated time and resuming from that file if it already exists.
+fork() copies a Run, optionally onto new random number streams, so that
+one warm-up can be continued many times:
+
+    warm = start(duration=60*24, model=Model(rng=default_rng(1)))
+    advance(warm, 60*3)
+    results = [finish(fork(warm, seed)) for seed in range(20)]
+"""
+
+import io
+import os
+import pickle
+import zlib
+
+import numpy as np
+
+from bus_route import Stats, build_world, run_events, start_buses
+from scheduler import HeapQueue
+from simulation import Model
+
+
+class Run:
+    """A simulation in progress, paused after time."""
+    def __init__(self, duration, model, world, events, stats, headways):
+        self.duration = duration
+        self.model = model
+        self.world = world
+        self.events = events
+        self.stats = stats
+        self.headways = headways
+        self.time = 0
+        self.finished = False
+
+
+def start(duration=300, model=None, queue=HeapQueue, stats=None, routes=1,
+          stops=31, passengers=12444, length=6.7, fleet_size=12,
+          headway=15, route_seed=None):
+    """Build a Run of the scenario simulate() in bus_route would run,
+    paused before its first event."""
+    if model is None:
+        model = Model()
+    world = build_world(model, routes, stops, passengers, length,
+                        fleet_size, route_seed)
+    headways = [headway] * len(world.routes)
+    events = queue()
+    start_buses(world, model, events, duration, headways)
+    if stats is None:
+        stats = Stats(world.routes[0].name)
+    return Run(duration, model, world, events, stats, headways)
+
+
+def advance(run, until=None):
+    """Continue a run until time, or until it is finished, and return
+    it."""
+    if not run.finished:
+        run.finished = run_events(run.events, run.duration, run.model,
+                                  run.stats, until=until)
+        if until is not None:
+            run.time = max(run.time, until)
+    return run
+
+
+def finish(run):
+    """Continue a run to the end and return its report."""
+    return advance(run).stats.report()
+
+
+class _Pickler(pickle.Pickler):
+    # the numpy.random module cannot be pickled; it is saved by name,
+    # and its state is saved alongside the run
+    def persistent_id(self, obj):
+        if obj is np.random:
+            return 'numpy.random'
+        return None
+
+
+class _Unpickler(pickle.Unpickler):
+    def persistent_load(self, pid):
+        if pid == 'numpy.random':
+            return np.random
+        raise pickle.UnpicklingError(f'unknown persistent id {pid!r}')
+
+
+def dumps(run):
+    """Returns a compressed snapshot of a run."""
+    buffer = io.BytesIO()
+    _Pickler(buffer, pickle.HIGHEST_PROTOCOL).dump(
+        (run, np.random.get_state()))
+    return zlib.compress(buffer.getvalue())
+
+
+def loads(snapshot, restore_global=True):
+    """Returns the run in a snapshot. The global numpy.random state is
+    restored to its state when the snapshot was taken, unless
+    restore_global is false."""
+    run, state = _Unpickler(io.BytesIO(zlib.decompress(snapshot))).load()
+    if restore_global:
+        np.random.set_state(state)
+    return run
+
+
+def save(run, path):
+    """Write a snapshot of a run to path. The snapshot is written under
+    a temporary name and then renamed, so a crash while saving leaves
+    the previous snapshot in place."""
+    partial = f'{path}.partial'
+    with open(partial, 'wb') as f:
+        f.write(dumps(run))
+    os.replace(partial, path)
+
+
+def load(path, restore_global=True):
+    """Read a run from a snapshot written by save()."""
+    with open(path, 'rb') as f:
+        return loads(f.read(), restore_global)
+
+
+def fork(run, seed=None):
+    """Returns an independent copy of a run. If a seed is given, the copy
+    draws from a new generator seeded with it, so that forks of one run
+    continue differently."""
+    copy = loads(dumps(run), restore_global=False)
+    if seed is not None:
+        model = copy.model.with_rng(np.random.default_rng(seed))
+        for direction, fleet in zip(copy.world.routes, copy.world.fleets):
+            for stop in direction:
+                stop.model = model
+            for bus in fleet:
+                bus.rng = model.demand
+        copy.model = model
+    return copy
+
+
+def simulate(path, every=60, **params):
+    """Run a simulation, saving it to path every so many minutes of
+    simulated time, and return its report. If path already holds a
+    snapshot, the run resumes from it and params are ignored."""
+    if os.path.exists(path):
+        run = load(path)
+    else:
+        run = start(**params)
+    while not run.finished:
+        advance(run, run.time + every)
+        save(run, path)
+    return run.stats.report()
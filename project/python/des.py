@@ -0,0 +1,107 @@
+"""A small discrete event simulation kernel.
+
+Every model in this repository is driven by the same loop: pop the
+earliest pending event, trigger it against the model's state, and
+schedule whatever event follows it. This module holds the shared parts
+of that loop:
+
+- Event, a slotted event record ordered by time;
+- Renewal, an event that recurs after a random delay each time it
+  triggers, as every arrival process in the homework models does;
+- run(), which triggers events from a future event list in time order
+  up to an optional horizon or stopping event.
+
+The bus simulation (bus_route.run_events) and the homework models all
+run on it; the bus events take the Model as their state.
+
+The future event list is scheduler.HeapQueue, a binary heap that, unlike
+queue.PriorityQueue, takes no lock on every put and get, and returns
+events with equal times in the order they were scheduled.
+
+The homework scripts import this module from project/python:
+
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(
+        __file__)), '..', 'project', 'python'))
+    from des import HeapQueue, Renewal, run
+"""
+
+from random import expovariate
+
+from scheduler import HeapQueue
+
+__all__ = ['Event', 'HeapQueue', 'Renewal', 'run']
+
+
+class Event:
+    """An event at a given time. Subclasses define trigger(), which
+    updates the state of the model and returns the event that follows,
+    or None."""
+    __slots__ = ('time',)
+
+    def __init__(self, time):
+        self.time = time
+
+    def trigger(self, state):
+        """Triggers the event and modifies the current state accordingly,
+        returning the next event to schedule, if any."""
+
+    def __lt__(self, other):
+        return self.time < other.time
+
+
+class Renewal(Event):
+    """An event of a process that recurs at a given rate: initialized
+    with a random delay from the current time, and followed, each time
+    it triggers, by another event of the same type. Subclasses define
+    apply() to modify the state, and may override delay(), which draws
+    exponential inter-arrival times by default."""
+    __slots__ = ()
+    rate = 1
+
+    def __init__(self, time):
+        self.time = time + self.delay()
+
+    def delay(self):
+        """Returns the time to the next event of this type."""
+        return expovariate(self.rate)
+
+    def apply(self, state):
+        """Modifies the current state according to the event."""
+
+    def trigger(self, state):
+        self.apply(state)
+        return self.get_next()
+
+    def get_next(self):
+        """Create a new event of the same type, occuring some time in
+        the future based on that event's inter-arrival time
+        distribution."""
+        return type(self)(self.time)
+
+
+def run(events, state, horizon=None, observe=None, stop=None,
+        trigger=None):
+    """Trigger events from a future event list in time order, scheduling
+    the event each returns, until the list is empty, its next event is
+    after horizon, or stop(event) is true of its next event. Events left
+    pending can be triggered by calling run() again. observe(event,
+    state) is called after every event is triggered, and trigger(event,
+    state), if given, is called in place of event.trigger(state), for
+    example to time it. Returns the number of events triggered."""
+    triggered = 0
+    while events:
+        if horizon is not None and events.peek().time > horizon:
+            break
+        if stop is not None and stop(events.peek()):
+            break
+        event = events.pop()
+        if trigger is None:
+            next_event = event.trigger(state)
+        else:
+            next_event = trigger(event, state)
+        if observe is not None:
+            observe(event, state)
+        if next_event is not None:
+            events.push(next_event)
+        triggered += 1
+    return triggered
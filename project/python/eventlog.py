@@ -0,0 +1,141 @@
+"""A columnar log of simulation events.
+
+An EventLog passed to simulate() records, for every triggered event, the
+time, event type, bus, route, stop, passengers boarded and alighted and
+the load on board after the event. Rows are written into a preallocated
+NumPy record buffer and flushed a chunk at a time, so memory use is
+bounded however long the run.
+
+By default the log is a directory holding one .npy file per column,
+which read_log() memory-maps for zero-copy analysis. Buses and routes
+are numbered in order of appearance; their names, and the names of the
+event types, are kept in meta.json alongside the columns. If pyarrow is
+installed, the log can instead be written as a Parquet file, one row
+group per chunk, with the names in a .meta.json file beside it."""
+
+import json
+import os
+
+import numpy as np
+
+EVENT_TYPES = ('BusArrival', 'BusDeparture')
+RECORD = np.dtype([('time', '<f8'), ('event', 'u1'), ('bus', '<i4'),
+                   ('route', '<i4'), ('stop', '<i4'), ('boarded', '<i4'),
+                   ('alighted', '<i4'), ('load', '<i4')])
+
+# .npy headers are written at a fixed length, large enough for any row
+# count, so that they can be rewritten in place when the log is closed
+HEADER_LENGTH = 128
+
+
+def npy_header(dtype, rows):
+    """Returns a version 1.0 .npy header of HEADER_LENGTH bytes for a
+    one-dimensional array."""
+    header = repr({'descr': np.lib.format.dtype_to_descr(dtype),
+                   'fortran_order': False, 'shape': (rows,)})
+    prefix = b'\x93NUMPY\x01\x00'
+    size = HEADER_LENGTH - len(prefix) - 2
+    header = header.ljust(size - 1) + '\n'
+    return prefix + size.to_bytes(2, 'little') + header.encode('latin1')
+
+
+class EventLog:
+    """Records events in chunks of rows to a columnar file at path."""
+    def __init__(self, path, chunk=1 << 16, format='npy'):
+        if format not in ('npy', 'parquet'):
+            raise ValueError(f'unknown event log format {format!r}')
+        self.path = path
+        self.format = format
+        self.rows = 0
+        self.buses = {}
+        self.routes = {}
+        self._buffer = np.empty(chunk, dtype=RECORD)
+        self._next = 0
+        self._event_codes = {name: i for i, name in enumerate(EVENT_TYPES)}
+        if format == 'parquet':
+            # pylint: disable=import-outside-toplevel
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            self._pa = pa
+            self._writer = pq.ParquetWriter(
+                path, pa.schema([(name, pa.from_numpy_dtype(RECORD[name]))
+                                 for name in RECORD.names]))
+        else:
+            os.makedirs(path, exist_ok=True)
+            self._files = {}
+            for name in RECORD.names:
+                f = open(os.path.join(path, f'{name}.npy'), 'wb')
+                f.write(npy_header(RECORD[name], 0))
+                self._files[name] = f
+
+    def record(self, event):
+        """Add a row for an event that has just triggered."""
+        bus = self.buses.setdefault(event.bus.name, len(self.buses))
+        route = self.routes.setdefault(event.stop.route.name,
+                                       len(self.routes))
+        self._buffer[self._next] = (
+            event.time, self._event_codes[type(event).__name__], bus, route,
+            event.stop.index, event.boarded, event.alighted,
+            event.bus.passengers)
+        self._next += 1
+        if self._next == len(self._buffer):
+            self.flush()
+
+    def flush(self):
+        """Write buffered rows."""
+        rows = self._buffer[:self._next]
+        if self.format == 'parquet':
+            self._writer.write_table(self._pa.table(
+                {name: rows[name] for name in RECORD.names}))
+        else:
+            for name, f in self._files.items():
+                rows[name].tofile(f)
+        self.rows += self._next
+        self._next = 0
+
+    def close(self):
+        """Flush remaining rows and finish the file."""
+        self.flush()
+        if self.format == 'parquet':
+            self._writer.close()
+        else:
+            for name, f in self._files.items():
+                f.seek(0)
+                f.write(npy_header(RECORD[name], self.rows))
+                f.close()
+        with open(meta_path(self.path), 'w') as f:
+            json.dump({'rows': self.rows, 'events': EVENT_TYPES,
+                       'buses': list(self.buses),
+                       'routes': list(self.routes)}, f)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def meta_path(path):
+    """Returns the path of the names file for a log at path."""
+    if os.path.isdir(path):
+        return os.path.join(path, 'meta.json')
+    return f'{path}.meta.json'
+
+
+def read_log(path):
+    """Returns the columns of an event log as a dictionary of arrays,
+    memory-mapped for .npy logs, with the row count and the names of
+    event types, buses and routes under 'meta'."""
+    if os.path.isdir(path):
+        columns = {name: np.load(os.path.join(path, f'{name}.npy'),
+                                 mmap_mode='r')
+                   for name in RECORD.names}
+    else:
+        # pylint: disable=import-outside-toplevel
+        import pyarrow.parquet as pq
+        table = pq.read_table(path, memory_map=True)
+        columns = {name: table.column(name).to_numpy()
+                   for name in RECORD.names}
+    with open(meta_path(path)) as f:
+        columns['meta'] = json.load(f)
+    return columns
@@ -0,0 +1,139 @@
+"""Instrumentation for the event simulation.
+
+An Instruments object passed to simulate() counts events by type,
+times each event's trigger() and the following Stats.record(), tracks
+the depth of the future event list, and times every call to the model's
+samplers and random variate sources. Every sample-th event is also
+written to a trace. Without instruments, simulate() pays for a single
+test per event."""
+
+from copy import copy
+from time import perf_counter
+
+import pandas as pd
+
+from simulation import BusDeparture
+from streaming import RunningStats
+
+SAMPLERS = ('get_travel_time', 'get_loading_time', 'get_unloading_time',
+            'get_wait_time')
+SOURCES = ('demand', 'traffic', 'dwell')
+VARIATES = ('normal', 'uniform', 'poisson', 'binomial')
+
+
+class Timed:
+    """Stands in for an object, timing calls to some of its methods and
+    passing everything else through."""
+    def __init__(self, target, names, timers, prefix):
+        self._target = target
+        for name in names:
+            setattr(self, name, timed(getattr(target, name), timers,
+                                      f'{prefix}.{name}'))
+
+    def __getattr__(self, name):
+        return getattr(self._target, name)
+
+
+def timed(function, timers, label):
+    """Wrap function so that the number of calls and the time spent in
+    it are accumulated in timers[label]."""
+    timer = timers.setdefault(label, [0, 0.0])
+    def wrapper(*args, **kwargs):
+        start = perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            timer[0] += 1
+            timer[1] += perf_counter() - start
+    return wrapper
+
+
+class Instruments:
+    """Counters, timers and a sampled trace for one or more simulation
+    runs."""
+    def __init__(self, sample=100, max_trace=100000):
+        self.sample = sample
+        self.max_trace = max_trace
+        self.counts = {}
+        self.timers = {}
+        self.depth = RunningStats()
+        self.max_depth = 0
+        self.events = 0
+        self._trace = []
+        self._chained = set()
+
+    def wrap_model(self, model):
+        """Returns a copy of model whose samplers and variate sources are
+        timed."""
+        model = copy(model)
+        for name in SAMPLERS:
+            setattr(model, name, timed(getattr(model, name), self.timers,
+                                       f'Model.{name}'))
+        wrapped = {}
+        for name in SOURCES:
+            source = getattr(model, name)
+            if id(source) not in wrapped:
+                wrapped[id(source)] = Timed(source, VARIATES, self.timers,
+                                            name)
+            setattr(model, name, wrapped[id(source)])
+        return model
+
+    def step(self, event, model, stats, depth):
+        """Trigger and record an event, measuring both, and return the
+        next event. depth is the number of other pending events."""
+        label = type(event).__name__
+        if id(event) in self._chained:
+            self._chained.discard(id(event))
+            label = 'BusDeparture (chained)'
+        self.counts[label] = self.counts.get(label, 0) + 1
+
+        start = perf_counter()
+        next_event = event.trigger(model)
+        triggered = perf_counter()
+        stats.record(event)
+        recorded = perf_counter()
+        self._add_time(f'{label}.trigger', triggered - start)
+        self._add_time('Stats.record', recorded - triggered)
+
+        if (isinstance(event, BusDeparture)
+                and isinstance(next_event, BusDeparture)):
+            self._chained.add(id(next_event))
+        self.depth.add(depth)
+        self.max_depth = max(self.max_depth, depth)
+        if (self.events % self.sample == 0
+                and len(self._trace) < self.max_trace):
+            self._trace.append((event.time, label, str(event.bus),
+                                event.stop.route.name, str(event.stop),
+                                depth, triggered - start))
+        self.events += 1
+        return next_event
+
+    def _add_time(self, label, elapsed):
+        timer = self.timers.setdefault(label, [0, 0.0])
+        timer[0] += 1
+        timer[1] += elapsed
+
+    def summary(self):
+        """Returns a table of call counts and times, by most total time,
+        with event counts and event list depth."""
+        table = pd.DataFrame(
+                [(label, calls, total, total / calls * 1e6 if calls else 0)
+                 for label, (calls, total) in self.timers.items()],
+                columns=['label', 'calls', 'total_sec', 'mean_us'])
+        table = table.set_index('label').sort_values('total_sec',
+                                                     ascending=False)
+        events = pd.DataFrame(
+                {'calls': list(self.counts.values())},
+                index=pd.Index([f'events: {label}' for label in self.counts],
+                               name='label'))
+        depth = pd.DataFrame(
+                {'calls': [self.depth.mean, self.max_depth]},
+                index=pd.Index(['event list depth: mean',
+                                'event list depth: max'], name='label'))
+        return pd.concat([events, depth, table])
+
+    def trace(self):
+        """Returns the sampled trace of events as a DataFrame."""
+        return pd.DataFrame(self._trace, columns=[
+            'time', 'event', 'bus', 'route', 'stop', 'depth',
+            'trigger_sec'])
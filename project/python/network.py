@@ -0,0 +1,149 @@
+"""Simulate a network of bus routes.
+
+A network is a list of RouteSpecs, each naming the stops a two-way
+route serves in order and giving its demand, length, fleet and headway.
+Stops are identified by name, so routes listing the same stop share it;
+passengers at a shared stop wait for their own route, and boardings and
+alightings are reported per stop over every route that serves it.
+
+Every bus in the network runs on one future event list. Each event
+touches only its own bus and stop, and statistics are kept per route
+direction in a dictionary, so with a CalendarQueue the cost of an event
+does not grow with the size of the network."""
+
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+from bus_route import Stats, World, clear_world, run_events, start_buses
+from scheduler import CalendarQueue
+from setup import generate_bus_route
+from simulation import Bus, Model
+
+RouteSpec = namedtuple('RouteSpec', ['name', 'stops', 'passengers',
+                                     'length', 'fleet_size', 'headway'])
+
+# a built network: the World run by the simulation, the headway of each
+# direction in the World, and the route stops at each named stop
+Network = namedtuple('Network', ['world', 'headways', 'stops'])
+
+
+def random_specs(routes, stops=31, stop_pool=None, passengers=12444,
+                 length=6.7, fleet_size=12, headway=15, seed=None):
+    """Returns specs for a number of routes like the B35, each serving
+    stops drawn at random from a pool of stop_pool stops (by default
+    half as many as the routes serve in all, so that most stops are
+    shared by two routes)."""
+    rng = np.random.default_rng(seed)
+    if stop_pool is None:
+        stop_pool = max(stops, routes * stops // 2)
+    return [RouteSpec(f'Route {i + 1}',
+                      [f'S{s}' for s in rng.choice(stop_pool, stops,
+                                                   replace=False)],
+                      passengers, length, fleet_size, headway)
+            for i in range(routes)]
+
+
+def build_network(model, specs, route_seed=None):
+    """Build the routes and buses of a network of RouteSpecs. Stop
+    demand is drawn from the model, unless a route_seed is given, in
+    which case every network built with that seed shares the same
+    cached demand."""
+    directions = []
+    fleets = []
+    headways = []
+    stops = {}
+    buses = 0
+    for i, spec in enumerate(specs):
+        pair = []
+        for j, names in enumerate((spec.stops, spec.stops[::-1])):
+            seed = None if route_seed is None else (route_seed, 2 * i + j)
+            route = generate_bus_route(model, spec.passengers,
+                                       len(spec.stops), spec.length, seed)
+            route.name = f'{spec.name} {"EW"[j]}'
+            for stop, name in zip(route, names):
+                stop.name = name
+                stops.setdefault(name, []).append(stop)
+            pair.append(route)
+            directions.append(route)
+            fleets.append([Bus(name=f'Bus{buses + k + 1}', rng=model.demand)
+                           for k in range(spec.fleet_size)])
+            buses += spec.fleet_size
+            headways.append(spec.headway)
+        pair[0].round, pair[1].round = pair[1], pair[0]
+    return Network(World(directions, fleets), headways, stops)
+
+
+class NetworkStats:
+    """Statistics kept separately for every route direction."""
+    def __init__(self):
+        self.routes = {}
+        self.events = 0
+
+    def record(self, event):
+        """Record an event that has just triggered in the statistics of
+        its route direction."""
+        self.events += 1
+        name = event.stop.route.name
+        stats = self.routes.get(name)
+        if stats is None:
+            stats = self.routes[name] = Stats()
+        stats.record(event)
+
+    def merge(self, other):
+        """Combine the statistics recorded by another (independent) run
+        into this one."""
+        self.events += other.events
+        for name, stats in other.routes.items():
+            self.routes.setdefault(name, Stats()).merge(stats)
+        return self
+
+    def total(self):
+        """Returns the statistics of every route combined."""
+        total = Stats()
+        for stats in self.routes.values():
+            total.merge(stats)
+        return total
+
+    def report(self):
+        """Report statistics as a DataFrame with a row per route
+        direction."""
+        return pd.DataFrame({name: stats.report()
+                             for name, stats in self.routes.items()}).T
+
+
+def stop_report(network):
+    """Returns a DataFrame of the routes serving, and passengers
+    boarding and alighting at, every stop in a network, busiest
+    first."""
+    return pd.DataFrame(
+            [(name, len({stop.route.name[:-2] for stop in stops}),
+              sum(stop.total_loads for stop in stops),
+              sum(stop.total_unloads for stop in stops))
+             for name, stops in network.stops.items()],
+            columns=['stop', 'routes', 'boardings', 'alightings']
+            ).set_index('stop').sort_values('boardings', ascending=False)
+
+
+def simulate_network(specs=None, duration=300, model=None,
+                     queue=CalendarQueue, stats=None, route_seed=None,
+                     network=None, instruments=None, log=None):
+    """Run a single simulation of a network of RouteSpecs, returning
+    its NetworkStats. A Network built by build_network() can be given
+    instead of specs, in which case it is cleared first and can be
+    passed to stop_report() after the run."""
+    if model is None:
+        model = Model()
+    if stats is None:
+        stats = NetworkStats()
+    if instruments is not None:
+        model = instruments.wrap_model(model)
+    if network is None:
+        network = build_network(model, specs, route_seed)
+    else:
+        clear_world(network.world, model)
+    events = queue()
+    start_buses(network.world, model, events, duration, network.headways)
+    run_events(events, duration, model, stats, instruments, log)
+    return stats
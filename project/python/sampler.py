@@ -0,0 +1,83 @@
+"""Table-driven samplers for discrete distributions.
+
+poisson_table() builds the cumulative distribution of a poisson
+variate with a given mean, computed in log space so that large means,
+whose probability of zero underflows, are handled exactly; tables are
+cached by mean. PoissonTable draws variates from a table by binary
+search over uniforms, any number at a time. AliasTable draws from a
+finite distribution given by weights in constant time per variate
+(Walker's alias method, as set up by Vose, 1991)."""
+
+from functools import lru_cache
+from math import lgamma, log, sqrt
+
+import numpy as np
+import numpy.random
+
+# poisson tables cover this many standard deviations either side of the
+# mean; the mass beyond is far below double precision
+TAIL_DEVIATIONS = 12
+
+
+@lru_cache(maxsize=128)
+def poisson_table(mean):
+    """Returns the smallest value covered and the cumulative
+    probabilities of a poisson distribution with a given mean, from
+    that value up to one that the distribution exceeds with negligible
+    probability."""
+    if mean <= 0:
+        return 0, np.ones(1)
+    spread = TAIL_DEVIATIONS * sqrt(mean) + TAIL_DEVIATIONS
+    low = max(0, int(mean - spread))
+    k = np.arange(low, int(mean + spread) + 1)
+    log_pmf = (-mean + k * log(mean)
+               - np.array([lgamma(i + 1) for i in k.tolist()]))
+    cdf = np.cumsum(np.exp(log_pmf))
+    cdf /= cdf[-1]
+    cdf.setflags(write=False)
+    return low, cdf
+
+
+class PoissonTable:
+    """Draws poisson variates with a given mean by inversion, searching
+    a cached table of the distribution function."""
+    def __init__(self, mean, rng=None):
+        self.mean = mean
+        self.rng = numpy.random if rng is None else rng
+        self.low, self.cdf = poisson_table(mean)
+
+    def sample(self, size=None):
+        """Returns a poisson variate, or an array of size of them."""
+        u = self.rng.random(size)
+        k = self.low + np.searchsorted(self.cdf, u, side='right')
+        return int(k) if size is None else k
+
+
+class AliasTable:
+    """Draws indices from 0 to n - 1 with probabilities proportional to
+    n weights, each from a single uniform variate: its integer part,
+    scaled by n, picks a column of the table and its fractional part
+    decides between the column and its alias."""
+    def __init__(self, weights, rng=None):
+        self.rng = numpy.random if rng is None else rng
+        weights = np.asarray(weights, dtype=float)
+        n = len(weights)
+        scaled = weights * n / weights.sum()
+        self.prob = np.ones(n)
+        self.alias = np.arange(n)
+        small = [i for i in range(n) if scaled[i] < 1]
+        large = [i for i in range(n) if scaled[i] >= 1]
+        while small and large:
+            s, l = small.pop(), large.pop()
+            self.prob[s] = scaled[s]
+            self.alias[s] = l
+            scaled[l] -= 1 - scaled[s]
+            (small if scaled[l] < 1 else large).append(l)
+        # anything left over is 1 up to rounding
+
+    def sample(self, size=None):
+        """Returns an index, or an array of size of them."""
+        u = self.rng.random(size) * len(self.prob)
+        i = np.floor(u).astype(np.int64)
+        k = np.where(u - i < self.prob[i], i, self.alias[i])
+        return int(k) if size is None else k
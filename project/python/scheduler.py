@@ -0,0 +1,123 @@
+"""Future event lists for the bus simulation.
+
+A future event list holds pending events and hands them back in order of
+their time attribute. Events with equal times are returned in the order
+they were scheduled. Two implementations share the same interface
+(push, pop, peek and len): a binary heap, which costs O(log n) per
+event, and a calendar queue, which costs amortized O(1) per event when
+event times are spread evenly, as they are for large fleets."""
+
+from bisect import insort
+from heapq import heappush, heappop
+from math import floor
+
+
+class HeapQueue:
+    """A future event list backed by a binary heap."""
+    def __init__(self):
+        self._heap = []
+        self._count = 0
+
+    def push(self, event):
+        """Schedule an event."""
+        self._count += 1
+        heappush(self._heap, (event.time, self._count, event))
+
+    def pop(self):
+        """Remove and return the earliest event."""
+        return heappop(self._heap)[2]
+
+    def peek(self):
+        """Return the earliest event without removing it."""
+        return self._heap[0][2]
+
+    def __len__(self):
+        return len(self._heap)
+
+
+class CalendarQueue:
+    """A future event list backed by a calendar queue (Brown, 1988).
+
+    Events are hashed by time into a ring of buckets, each covering one
+    day of a given width, and the queue is read like a calendar, one day
+    at a time. The number of buckets doubles or halves with the number of
+    pending events, and the day width is re-estimated from the spacing
+    of the earliest events whenever the calendar is resized."""
+    def __init__(self, buckets=2, width=1.0):
+        self._count = 0
+        self._size = 0
+        self._setup(buckets, width, 0.0)
+
+    def _setup(self, buckets, width, time):
+        self._buckets = [[] for _ in range(buckets)]
+        self._width = width
+        self._day = self._day_of(time)
+
+    def _day_of(self, time):
+        return floor(time / self._width)
+
+    def _insert(self, entry):
+        day = self._day_of(entry[0])
+        insort(self._buckets[day % len(self._buckets)], entry)
+        if day < self._day:
+            self._day = day
+
+    def push(self, event):
+        """Schedule an event."""
+        self._count += 1
+        self._insert((event.time, self._count, event))
+        self._size += 1
+        if self._size > 2 * len(self._buckets):
+            self._resize(2 * len(self._buckets))
+
+    def _find(self):
+        """Return the bucket holding the earliest event, moving the
+        calendar to that event's day."""
+        buckets = self._buckets
+        for day in range(self._day, self._day + len(buckets)):
+            bucket = buckets[day % len(buckets)]
+            if bucket and self._day_of(bucket[0][0]) <= day:
+                self._day = day
+                return bucket
+        # nothing within a year; jump straight to the earliest event
+        bucket = min((b for b in buckets if b), key=lambda b: b[0])
+        self._day = self._day_of(bucket[0][0])
+        return bucket
+
+    def pop(self):
+        """Remove and return the earliest event."""
+        if not self._size:
+            raise IndexError('pop from an empty event list')
+        entry = self._find().pop(0)
+        self._size -= 1
+        if len(self._buckets) > max(2, 2 * self._size):
+            self._resize(len(self._buckets) // 2)
+        return entry[2]
+
+    def peek(self):
+        """Return the earliest event without removing it."""
+        if not self._size:
+            raise IndexError('peek at an empty event list')
+        return self._find()[0][2]
+
+    def _resize(self, buckets):
+        entries = sorted(e for bucket in self._buckets for e in bucket)
+        start = entries[0][0] if entries else 0.0
+        self._setup(buckets, self._estimate_width(entries), start)
+        for entry in entries:
+            self._insert(entry)
+
+    def _estimate_width(self, entries, sample=25):
+        """Estimate a day width of about three times the mean spacing of
+        the earliest events, ignoring unusually large gaps."""
+        times = [e[0] for e in entries[:sample]]
+        gaps = [b - a for a, b in zip(times, times[1:])]
+        if not gaps or not any(gaps):
+            return self._width
+        average = sum(gaps) / len(gaps)
+        close = [g for g in gaps if g <= 2 * average]
+        average = sum(close) / len(close)
+        return 3 * average if average > 0 else self._width
+
+    def __len__(self):
+        return self._size
@@ -1,29 +1,57 @@
 """Functions for setting up simulation world."""
 
-from numpy.random import uniform
+from functools import lru_cache
+
+import numpy as np
 
 from simulation import BusRoute, BusStop
 
 
-def generate_bus_route(model, passengers, stops, length):
+def generate_bus_route(model, passengers, stops, length, seed=None):
     """Generate a 2-way bus-route with uniformly random distribution of
-    load and unload demand and uniform traffic."""
-    passengers -= (stops - 1)
-    passengers = int(passengers)
-    loads = [1] * (stops - 1) + [0]
-    for _i in range(passengers):
-        loads[int((stops - 1) * uniform())] += 1
-    unloads = [0] + [1] * (stops - 1)
-    for i, stop in enumerate(loads):
-        for _i in range(stop - 1):
-            unloads[int((stops - i - 1)*uniform()) + i + 1] += 1
+    load and unload demand and uniform traffic. Demand is drawn from
+    the model's demand stream, or if a seed is given, from a generator
+    seeded with it; demand for a seed is generated once and cached, so
+    routes built from the same parameters and seed share it."""
+    if seed is None:
+        loads, unloads = route_demand(model.demand.uniform, passengers,
+                                      stops)
+    else:
+        loads, unloads = cached_demand(int(passengers), stops, seed)
     route = BusRoute()
     for i, (load, unload) in enumerate(zip(loads, unloads)):
         route.append(BusStop(
             model, load / 12 / 60, unload / 12 / 60, length / (stops - 1),
             (1.5, .4), str(i + 1)))
     route.calculate_destination_proba()
-    # print(passengers)
-    # print(loads)
-    # print(unloads)
     return route
+
+
+def route_demand(uniform, passengers, stops):
+    """Returns lists of the number of passengers loading and unloading
+    at each stop. Every stop but the last loads at least one passenger
+    and the rest are spread uniformly over those stops; every passenger
+    beyond the first at a stop unloads at a uniformly chosen later stop,
+    and every stop but the first unloads at least one. Uniforms are
+    drawn in one block each for loads and destinations, in the order
+    that drawing one per passenger would use them."""
+    passengers = int(passengers) - (stops - 1)
+    origins = (stops - 1) * np.asarray(uniform(size=passengers))
+    loads = np.bincount(origins.astype(int), minlength=stops)
+    loads[:-1] += 1
+    # every boarding passenger beyond the first at each stop, by origin
+    origins = np.repeat(np.arange(stops - 1), loads[:-1] - 1)
+    destinations = ((stops - origins - 1)
+                    * np.asarray(uniform(size=len(origins))))
+    unloads = np.bincount(destinations.astype(int) + origins + 1,
+                          minlength=stops)
+    unloads[1:] += 1
+    return loads.tolist(), unloads.tolist()
+
+
+@lru_cache(maxsize=256)
+def cached_demand(passengers, stops, seed):
+    """Returns route_demand() drawn from a generator seeded with seed,
+    which may be an integer or a tuple of integers."""
+    return route_demand(np.random.default_rng(seed).uniform, passengers,
+                        stops)
@@ -1,41 +1,138 @@
 """Event simulation classes."""
 
-from numpy.random import poisson, normal, binomial, uniform
+from collections import namedtuple
+from copy import copy
+from math import sqrt
+
+import numpy as np
+import numpy.random
+
+from des import Event
+from variates import VariatePool
 
 class Model:
-    """Probability models for various properties of the simulation."""
+    """Probability models for various properties of the simulation.
+    Random variates are drawn from rng, which may be a numpy Generator;
+    by default the global numpy.random state is used. If block is given,
+    the event samplers draw from a VariatePool refilled from rng in
+    blocks of that size. If aggregate is set, per-passenger sums are
+    drawn directly from their aggregate distributions, so sampling costs
+    the same however many passengers board.
+
+    Variates are drawn from three sources: demand (passenger arrivals,
+    waiting times and destinations, including generated routes),
+    traffic (travel times) and dwell (loading and unloading times). By
+    default all three share one stream; with_streams() gives each its
+    own, so that runs of different models can share common random
+    numbers."""
     def __init__(self, loading_time=(1/4, 1/10),
                  unloading_time=(1/8, 1/20),
-                 bus_speed=20 / 60):
+                 bus_speed=20 / 60, rng=None, block=None,
+                 aggregate=False):
         self.loading_time = loading_time
         self.unloading_time = unloading_time
         self.bus_speed = bus_speed
+        self.block = block
+        self.aggregate = aggregate
+        self.use_rng(rng)
+
+    def use_rng(self, rng):
+        """Draw all variates from a random number generator."""
+        self.rng = numpy.random if rng is None else rng
+        self.demand = self.traffic = self.dwell = (
+            self.rng if self.block is None
+            else VariatePool(self.rng, self.block))
+
+    def with_streams(self, seed, antithetic=False, inversion=False):
+        """Returns a copy of this model drawing demand, traffic and dwell
+        times from separate generators spawned from seed (an integer or
+        SeedSequence). Copies made with the same seed draw the same
+        streams. If inversion is set, every variate is a monotone
+        function of one pooled uniform or normal. Antithetic copies also
+        invert, and draw the mirror image of each stream."""
+        if not isinstance(seed, np.random.SeedSequence):
+            seed = np.random.SeedSequence(seed)
+        seed = np.random.SeedSequence(seed.entropy, spawn_key=seed.spawn_key)
+        demand, traffic, dwell = (np.random.default_rng(s)
+                                  for s in seed.spawn(3))
+        model = self.with_rng(demand)
+        if inversion or antithetic:
+            model.demand, model.traffic, model.dwell = (
+                VariatePool(rng, self.block or 4096, True, antithetic)
+                for rng in (demand, traffic, dwell))
+        elif self.block:
+            model.traffic = VariatePool(traffic, self.block)
+            model.dwell = VariatePool(dwell, self.block)
+        else:
+            model.traffic, model.dwell = traffic, dwell
+        return model
+
+    def with_rng(self, rng):
+        """Returns a copy of this model drawing from a different random
+        number generator."""
+        model = copy(self)
+        model.use_rng(rng)
+        return model
 
     def get_travel_time(self, distance, traffic_distribution):
         """Returns the time to cover a given distance given a traffic
         distribution."""
-        traffic = max(0, normal(*traffic_distribution))
+        traffic = max(0, self.traffic.normal(*traffic_distribution))
         # print(f'Traffic: {traffic:.3f}')
         return distance / self.bus_speed * traffic
 
     def get_loading_time(self, passengers):
         """Returns the time for a given number of passengers to load a bus."""
-        return sum(normal(*self.loading_time, passengers))
+        return self.sum_normals(*self.loading_time, passengers)
 
     def get_unloading_time(self, passengers):
         """Returns the time for a given number of passengers to unload
         from a bus."""
-        return sum(normal(*self.unloading_time, passengers))
+        return self.sum_normals(*self.unloading_time, passengers)
+
+    def get_wait_time(self, passengers, time_delta):
+        """Returns the total time waited by a number of passengers who
+        arrived uniformly over an interval of time_delta. In aggregate
+        mode, the sum of uniforms is drawn from a normal distribution
+        with matching mean and variance, truncated to its support."""
+        if not self.aggregate:
+            return sum(self.demand.uniform(0, time_delta, passengers))
+        if not passengers:
+            return 0
+        wait = self.demand.normal(passengers * time_delta / 2,
+                                  time_delta * sqrt(passengers / 12))
+        return min(max(0, wait), passengers * time_delta)
+
+    def sum_normals(self, mean, std, count):
+        """Returns the sum of count normal variates. In aggregate mode,
+        the sum is drawn as a single normal variate."""
+        if not self.aggregate:
+            return sum(self.dwell.normal(mean, std, count))
+        if not count:
+            return 0
+        return self.dwell.normal(count * mean, sqrt(count) * std)
+
+RouteArrays = namedtuple('RouteArrays', [
+    'passenger_rate', 'destination_rate', 'destination_proba',
+    'distance_to', 'traffic_to', 'waiting', 'last_emptied'])
+
 
 class BusRoute:
-    """A linked list of bus stops."""
+    """A linked list of bus stops. Stops are also numbered in route
+    order, and can be looked up by that index."""
+    __slots__ = ('head', 'last', 'name', 'size', 'schedule', 'round',
+                 'stops')
+
     def __init__(self, head=None, name=''):
-        self.head = head
-        self.last = head
+        self.head = None
+        self.last = None
         self.name = name
-        self.size = 0 if head is None else 1
+        self.size = 0
         self.schedule = []
         self.round = None
+        self.stops = []
+        if head is not None:
+            self.append(head)
 
     def append(self, stop):
         if self.last is None:
@@ -44,8 +141,24 @@ class BusRoute:
             self.last.next = stop
         self.last = stop
         stop.route = self
+        stop.index = self.size
+        self.stops.append(stop)
         self.size += 1
 
+    def arrays(self):
+        """Returns the stop parameters and current state of the route
+        as a RouteArrays of NumPy arrays indexed by stop, for use by
+        vectorized engines."""
+        stops = self.stops
+        return RouteArrays(
+            np.array([s.passenger_rate for s in stops], dtype=float),
+            np.array([s.destination_rate for s in stops], dtype=float),
+            np.array([s.destination_proba for s in stops], dtype=float),
+            np.array([s.distance_to for s in stops], dtype=float),
+            np.array([s.traffic_to for s in stops], dtype=float),
+            np.array([s.waiting for s in stops], dtype=np.int64),
+            np.array([s.last_emptied for s in stops], dtype=float))
+
     def calculate_destination_proba(self):
         """Calculates and assigns the destination probabilities for each
         bus stop in the route."""
@@ -60,6 +173,14 @@ class BusRoute:
             # print(node.destination_proba)
             node = node.next
 
+    def clear(self, model=None):
+        """Return the route and its stops to the state they were built
+        in, keeping the stops and their parameters, and optionally
+        bind the stops to a different model."""
+        self.schedule = []
+        for stop in self.stops:
+            stop.clear(model)
+
     def add_bus(self, model, time, bus):
         """Add a new bus to this route, using scheduled times if
         available."""
@@ -74,10 +195,21 @@ class BusRoute:
             yield node
             node = node.next
 
+    def __getitem__(self, index):
+        return self.stops[index]
+
+    def __len__(self):
+        return self.size
+
 
 class BusStop:
     """A bus stop accumulates passengers until a bus arrives to pick
     those passengers up."""
+    __slots__ = ('model', 'passenger_rate', 'destination_rate',
+                 'distance_to', 'traffic_to', 'name', 'next', 'route',
+                 'index', 'destination_proba', 'last_emptied', 'waiting',
+                 'total_loads', 'total_unloads')
+
     def __init__(self, model, passenger_rate, destination_rate,
                  distance_to, traffic_to, name='', route=None):
         self.model = model
@@ -88,6 +220,7 @@ class BusStop:
         self.name = name
         self.next = None
         self.route = route
+        self.index = None
         self.destination_proba = None
         self.last_emptied = 0
         self.waiting = 0
@@ -98,9 +231,10 @@ class BusStop:
         """Measures the number of passengers arriving since the stop
         last emptied to time, and then empties again."""
         time_delta = max(0, time - self.last_emptied)
-        passengers = poisson(self.passenger_rate * time_delta)
+        passengers = self.model.demand.poisson(
+            self.passenger_rate * time_delta)
         wait_time = (self.waiting * time_delta +
-                     sum(uniform(0, time_delta, passengers)))
+                     self.model.get_wait_time(passengers, time_delta))
         passengers += self.waiting
         return passengers, wait_time
 
@@ -110,16 +244,31 @@ class BusStop:
         self.last_emptied = time
         self.waiting = remaining
 
+    def clear(self, model=None):
+        """Return the stop to the state it was built in, optionally
+        drawing from a different model."""
+        if model is not None:
+            self.model = model
+        self.last_emptied = 0
+        self.waiting = 0
+        self.total_loads = 0
+        self.total_unloads = 0
+
     def __str__(self):
         return str(self.name)
 
 
 class Bus:
     """A bus follows a route, picking up and dropping off passengers."""
-    def __init__(self, capacity=115, doors=2, name=''):
+    __slots__ = ('capacity', 'doors', 'name', 'rng', 'passengers',
+                 'passenger_time', 'passengers_carried', 'timestamp',
+                 'route_start')
+
+    def __init__(self, capacity=115, doors=2, name='', rng=None):
         self.capacity = capacity
         self.doors = doors
         self.name = name
+        self.rng = numpy.random if rng is None else rng
         self.passengers = 0
         self.passenger_time = 0
         self.passengers_carried = 0
@@ -141,7 +290,7 @@ class Bus:
 
     def unload(self, destination_proba):
         """Unloads passengers at their destination."""
-        passengers = binomial(self.passengers, destination_proba)
+        passengers = self.rng.binomial(self.passengers, destination_proba)
         self.passengers -= passengers
         return passengers
 
@@ -159,35 +308,25 @@ class Bus:
         self.passengers_carried = 0
         return passenger_time, passengers_carried
 
+    def clear(self, rng=None):
+        """Return the bus, empty, to the state it was built in,
+        optionally drawing from a different random number generator."""
+        if rng is not None:
+            self.rng = rng
+        self.passengers = 0
+        self.passenger_time = 0
+        self.passengers_carried = 0
+        self.timestamp = 0
+        self.route_start = None
 
     def __str__(self):
         return str(self.name)
 
 
-class Event:
-    """An event, initialized with a random arrival time, according to a
-    poisson process and specified rate, and offset from the current
-    time."""
-    rate = 1
-    def __init__(self, time):
-        self.time = time + poisson(self.rate)
-
-    def trigger(self, model, state):
-        """Triggers the event and modifies the current state accordingly."""
-
-    def get_next(self):
-        """Create a new event of the same type, occuring some time in
-        the future based on that event's inter-arrival time
-        distribution."""
-        return type(self)(self.time)
-
-    def __lt__(self, other):
-        return self.time < other.time
-
-
 class BusArrival(Event):
     """A bus arrives at a stop and begins loading and unloading
     passengers. Followed by BusDeparture."""
+    __slots__ = ('bus', 'stop', 'route_start', 'boarded', 'alighted')
     # pylint: disable=super-init-not-called
     def __init__(self, model, time, bus, stop):
         self.time = time + model.get_travel_time(stop.distance_to,
@@ -195,8 +334,9 @@ class BusArrival(Event):
         self.bus = bus
         self.stop = stop
         self.route_start = self.bus.route_start
+        self.boarded = self.alighted = 0
 
-    def trigger(self, model, _state):
+    def trigger(self, model):
         # print(f'{self.bus} {self.time:.3f}: Arriving at {self.stop}.')
         self.bus.elapse_time(self.time)
         unloading = self.bus.unload(self.stop.destination_proba)
@@ -207,6 +347,7 @@ class BusArrival(Event):
         # return a BusDeparture event
         self.stop.total_unloads += unloading
         self.stop.total_loads += loading - remaining
+        self.boarded, self.alighted = loading - remaining, unloading
         next_event = BusDeparture(model, self.time, self.bus, self.stop,
                                   loading - remaining, unloading)
         return next_event
@@ -218,23 +359,26 @@ class BusDeparture(Event):
     """A bus loads any remaining passengers and then leaves for the next
     stop. Will continue generating BusDeparture events until no
     passengers remain to load."""
+    __slots__ = ('bus', 'stop', 'boarded', 'alighted')
     # pylint: disable=super-init-not-called
     def __init__(self, model, time, bus, stop, loading, unloading=0):
         self.time = time + model.get_unloading_time(unloading) \
                 + model.get_loading_time(loading)
         self.bus = bus
         self.stop = stop
+        self.boarded = self.alighted = 0
         # if unloading:
         #     print(f'{self.bus} {self.time:.3f}: Unloading {unloading} passengers.')
         # print(f'{self.bus} {self.time:.3f}: Loading {loading} passengers.')
 
-    def trigger(self, model, state):
+    def trigger(self, model):
         self.bus.elapse_time(self.time)
         passengers, wait_time = self.stop.get_passengers(self.time)
         # TO-DO: Calculate passenger wait time
         remaining = self.bus.board(passengers, 0)
         self.stop.reset(self.time, remaining)
         self.stop.total_loads += passengers - remaining
+        self.boarded = passengers - remaining
         if passengers - remaining > 0:
             return BusDeparture(model, self.time, self.bus, self.stop,
                                 passengers - remaining)
@@ -0,0 +1,164 @@
+"""Constant-memory statistics for streams of observations.
+
+RunningStats keeps a weighted mean and variance (West's update of
+Welford's algorithm) together with a TDigest quantile sketch. Both use
+memory independent of the number of observations, and both can be
+merged, so statistics gathered by separate runs or worker processes can
+be combined."""
+
+from math import asin, nan, pi, sin, sqrt
+
+
+class TDigest:
+    """A merging t-digest (Dunning and Ertl, 2019) estimating quantiles
+    of a stream. Observations are buffered and periodically merged into
+    at most about compression centroids, which are smallest near the
+    tails so that extreme quantiles stay accurate."""
+    __slots__ = ('compression', 'count', 'min', 'max', '_centroids',
+                 '_buffer')
+
+    def __init__(self, compression=100):
+        self.compression = compression
+        self.count = 0
+        self.min = nan
+        self.max = nan
+        self._centroids = []
+        self._buffer = []
+
+    def add(self, value, weight=1):
+        """Add an observation with a given weight."""
+        if not self.count or value < self.min:
+            self.min = value
+        if not self.count or value > self.max:
+            self.max = value
+        self.count += weight
+        self._buffer.append((value, weight))
+        if len(self._buffer) > 5 * self.compression:
+            self._compress()
+
+    def merge(self, other):
+        """Add all observations summarized by another digest."""
+        if not other.count:
+            return self
+        if not self.count or other.min < self.min:
+            self.min = other.min
+        if not self.count or other.max > self.max:
+            self.max = other.max
+        self.count += other.count
+        self._buffer.extend(other._centroids)
+        self._buffer.extend(other._buffer)
+        self._compress()
+        return self
+
+    def _scale(self, q):
+        return self.compression / (2 * pi) * asin(2 * q - 1)
+
+    def _inverse_scale(self, k):
+        if k >= self.compression / 4:
+            return 1
+        return (sin(k * 2 * pi / self.compression) + 1) / 2
+
+    def _compress(self):
+        points = sorted(self._centroids + self._buffer)
+        self._buffer = []
+        if not points:
+            return
+        merged = []
+        seen = 0
+        limit = self._inverse_scale(self._scale(0) + 1) * self.count
+        mean, weight = points[0]
+        for value, w in points[1:]:
+            if seen + weight + w <= limit:
+                weight += w
+                mean += (value - mean) * w / weight
+            else:
+                merged.append((mean, weight))
+                seen += weight
+                limit = self._inverse_scale(
+                    self._scale(seen / self.count) + 1) * self.count
+                mean, weight = value, w
+        merged.append((mean, weight))
+        self._centroids = merged
+
+    def quantile(self, q):
+        """Estimate the q-th quantile, for q between 0 and 1."""
+        if self._buffer:
+            self._compress()
+        if not self._centroids:
+            return nan
+        target = q * self.count
+        previous, previous_center = self.min, 0
+        seen = 0
+        for mean, weight in self._centroids:
+            center = seen + weight / 2
+            if target < center:
+                return previous + ((mean - previous)
+                                   * (target - previous_center)
+                                   / (center - previous_center))
+            previous, previous_center = mean, center
+            seen += weight
+        if self.count == previous_center:
+            return self.max
+        return previous + ((self.max - previous) * (target - previous_center)
+                           / (self.count - previous_center))
+
+
+class RunningStats:
+    """Weighted running mean and variance of a stream, with a quantile
+    sketch."""
+    __slots__ = ('count', 'weight', 'mean', '_m2', 'digest')
+
+    def __init__(self, compression=100):
+        self.count = 0
+        self.weight = 0
+        self.mean = nan
+        self._m2 = 0
+        self.digest = TDigest(compression)
+
+    def add(self, value, weight=1):
+        """Add an observation with a given (frequency) weight."""
+        if weight <= 0:
+            return
+        self.count += 1
+        self.weight += weight
+        if self.count == 1:
+            self.mean = value
+        else:
+            delta = value - self.mean
+            self.mean += delta * weight / self.weight
+            self._m2 += weight * delta * (value - self.mean)
+        self.digest.add(value, weight)
+
+    def merge(self, other):
+        """Combine with the statistics of another stream."""
+        if not other.count:
+            return self
+        if not self.count:
+            self.mean = other.mean
+            self._m2 = other._m2
+        else:
+            weight = self.weight + other.weight
+            delta = other.mean - self.mean
+            self.mean += delta * other.weight / weight
+            self._m2 += (other._m2
+                         + delta**2 * self.weight * other.weight / weight)
+        self.count += other.count
+        self.weight += other.weight
+        self.digest.merge(other.digest)
+        return self
+
+    @property
+    def variance(self):
+        """The sample variance of the stream."""
+        if self.weight <= 1:
+            return nan
+        return self._m2 / (self.weight - 1)
+
+    @property
+    def std(self):
+        """The sample standard deviation of the stream."""
+        return sqrt(self.variance)
+
+    def quantile(self, q):
+        """Estimate the q-th quantile of the stream."""
+        return self.digest.quantile(q)
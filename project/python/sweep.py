@@ -0,0 +1,188 @@
+"""Sweep the parameters of the bus simulation.
+
+A design is a list of points, each a dictionary of parameters: Model
+parameters (loading_time, unloading_time, bus_speed, aggregate) and
+simulate() parameters (fleet_size, headway, stops, passengers, length,
+routes). grid() builds the full factorial design of some values and
+latin_hypercube() a space-filling design over ranges.
+
+sweep() runs a number of replications at every point in a pool of
+worker processes. Every point uses the same seed, so points are
+compared on common random numbers. Each point's results are written
+to a cache directory as soon as the point finishes, in a file named by
+a hash of its parameters, replications, duration and seed. Running a
+sweep again, after an interruption or with more points, only runs the
+points not yet in the cache.
+
+    points = grid(fleet_size=[10, 12, 14], headway=[10, 15, 20])
+    results = sweep(points, seed=2021, workers=os.cpu_count())
+    print(summary(results))
+"""
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import hashlib
+from itertools import product
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from bus_route import Stats, confidence, simulate
+from simulation import Model
+
+MODEL_PARAMETERS = ('loading_time', 'unloading_time', 'bus_speed',
+                    'aggregate')
+SIMULATE_PARAMETERS = ('routes', 'stops', 'passengers', 'length',
+                       'fleet_size', 'headway')
+
+
+def grid(**values):
+    """Returns every combination of the given values of each parameter
+    as a list of points."""
+    names = list(values)
+    return [dict(zip(names, combination))
+            for combination in product(*values.values())]
+
+
+def latin_hypercube(size, seed=None, **ranges):
+    """Returns a Latin hypercube design of size points over ranges given
+    as (low, high) for each parameter. Each parameter's range is cut
+    into size strata, and every stratum is sampled exactly once. Bounds
+    may be tuples, such as (mean, std) pairs, which are interpolated
+    element by element; parameters with integer bounds are rounded."""
+    rng = np.random.default_rng(seed)
+    points = [{} for _ in range(size)]
+    for name, (low, high) in ranges.items():
+        u = (rng.permutation(size) + rng.random(size)) / size
+        low, high = np.asarray(low, dtype=float), np.asarray(high,
+                                                             dtype=float)
+        integer = all(isinstance(bound, (int, np.integer))
+                      for bound in np.ravel(ranges[name]))
+        for point, fraction in zip(points, u):
+            value = low + fraction * (high - low)
+            if integer:
+                value = np.rint(value).astype(int)
+            point[name] = (tuple(value.tolist()) if value.ndim
+                           else value.item())
+    return points
+
+
+def point_key(point, replications, duration, seed):
+    """Returns the cache key of a point: a hash of its parameters, the
+    number of replications, the duration and the seed."""
+    text = json.dumps({'point': point, 'replications': replications,
+                       'duration': duration, 'seed': seed}, sort_keys=True)
+    return hashlib.sha256(text.encode()).hexdigest()[:24]
+
+
+def run_point(point, replications, duration, seed):
+    """Run replications of the simulation at one point, each drawing
+    from its own generator spawned from seed, and return a DataFrame of
+    results."""
+    unknown = set(point) - set(MODEL_PARAMETERS) - set(SIMULATE_PARAMETERS)
+    if unknown:
+        raise ValueError(
+            f'unknown parameters: {", ".join(sorted(unknown))}')
+    # JSON turns tuples into lists
+    model = Model(**{name: tuple(value) if isinstance(value, list)
+                     else value
+                     for name, value in point.items()
+                     if name in MODEL_PARAMETERS})
+    params = {name: value for name, value in point.items()
+              if name in SIMULATE_PARAMETERS}
+    children = np.random.SeedSequence(seed).spawn(replications)
+    return pd.DataFrame([
+        simulate(duration, model.with_rng(np.random.default_rng(child)),
+                 **params)
+        for child in children])
+
+
+def load_point(path):
+    """Returns the results cached at path, or None if there are none."""
+    try:
+        with open(path) as f:
+            return pd.DataFrame(json.load(f)['results'])
+    except FileNotFoundError:
+        return None
+
+
+def save_point(path, point, replications, duration, seed, results):
+    """Cache the results of a point at path. The file is written under
+    a temporary name and then renamed, so an interrupted write never
+    leaves a partial file in the cache."""
+    partial = f'{path}.partial'
+    with open(partial, 'w') as f:
+        json.dump({'point': point, 'replications': replications,
+                   'duration': duration, 'seed': seed,
+                   'results': results.to_dict('list')}, f)
+    os.replace(partial, path)
+
+
+def sweep(points, replications=20, duration=60*12, seed=0,
+          cache='sweep_cache', workers=None, verbose=False):
+    """Run replications at every point of a design, reusing results
+    cached in the cache directory and caching new ones as they finish.
+    Returns a DataFrame of every replication, with a column for the
+    index of its point and a column for each parameter."""
+    os.makedirs(cache, exist_ok=True)
+    # round-trip points through JSON so that cached and fresh points
+    # hash the same
+    points = [json.loads(json.dumps(point)) for point in points]
+    paths = [os.path.join(cache, point_key(point, replications, duration,
+                                           seed) + '.json')
+             for point in points]
+    results = [load_point(path) for path in paths]
+    missing = [i for i, result in enumerate(results) if result is None]
+    if verbose:
+        print(f'{len(points) - len(missing)} of {len(points)} points '
+              f'cached, running {len(missing)}')
+
+    def finish(i, result):
+        save_point(paths[i], points[i], replications, duration, seed,
+                   result)
+        results[i] = result
+        if verbose:
+            print(f'finished point {i}: {points[i]}')
+
+    if workers is None or workers == 1:
+        for i in missing:
+            finish(i, run_point(points[i], replications, duration, seed))
+    else:
+        with ProcessPoolExecutor(workers) as executor:
+            futures = {executor.submit(run_point, points[i], replications,
+                                       duration, seed): i
+                       for i in missing}
+            for future in as_completed(futures):
+                finish(futures[future], future.result())
+
+    frames = []
+    for i, (point, result) in enumerate(zip(points, results)):
+        result = result.copy()
+        for name, value in reversed(point.items()):
+            result.insert(0, name, [value] * len(result))
+        result.insert(0, 'point', i)
+        frames.append(result)
+    return pd.concat(frames, ignore_index=True)
+
+
+def summary(results, metric='mean_travel_time', level=.95):
+    """Returns the mean of a metric at each point of a sweep with the
+    half-width of a confidence interval for it."""
+    measures = set(Stats().report().index)
+    parameters = [name for name in results.columns[1:]
+                  if name not in measures]
+    rows = []
+    for _i, group in results.groupby('point', sort=True):
+        ci = confidence(group[[metric]], level)
+        rows.append({**group.iloc[0][parameters].to_dict(),
+                     metric: ci.loc['theta', metric],
+                     'confidence': ci.loc['confidence', metric]})
+    return pd.DataFrame(rows)
+
+
+if __name__ == '__main__':
+    pd.options.display.float_format = '{:.3f}'.format
+    print(summary(sweep(grid(fleet_size=[10, 12, 14],
+                             headway=[10, 15, 20]),
+                        seed=2021, workers=os.cpu_count(), verbose=True)))
@@ -0,0 +1,232 @@
+"""Simulate bus routes approximately, in fixed time steps.
+
+The event engine triggers an event for every arrival at a stop and
+another for every top-up of passengers who arrived while a bus was
+dwelling, so at large scale most of its time goes to chains of tiny
+BusDeparture events. The leaping engine instead advances the whole
+system by a fixed step at a time, with every random variate for a step
+drawn in one call per distribution:
+
+- every stop gains a Poisson number of passengers for the step (a tau
+  leap of its arrival process);
+- every travelling bus moves on by the step; a bus that reaches its
+  stop unloads and boards everyone waiting, as at a BusArrival;
+- every dwelling bus whose dwell has ended tops up with everyone who
+  arrived since, as at a BusDeparture, but at most once per step, and
+  leaves once there is no one to board.
+
+Alighting counts and dwell times are either drawn (binomial, with
+dwell times the normal sums of aggregate mode) or set to their means
+(fluid, with alighting counts rounded at random so that they stay
+unbiased). Arrival and departure times are interpolated within a step,
+so travel is exact and the step only limits how often a dwelling bus
+tops up and how finely boarding is timed; the error shrinks with the
+step. accuracy() compares the two engines on the same scenario."""
+
+import numpy as np
+import pandas as pd
+
+from batch import route_arrays, travel_time
+from bus_route import build_world, confidence, simulate
+from simulation import Bus, Model
+
+APPROXIMATIONS = ('binomial', 'fluid')
+
+
+def simulate_leaping(duration=300, model=None, step=.5,
+                     approximation='binomial', routes=1, stops=31,
+                     passengers=12444, length=6.7, fleet_size=12,
+                     headway=15, route_seed=None):
+    """Run a single simulation of the scenario simulate() in bus_route
+    would run, advancing time by step minutes at a time, and return
+    statistics with the same columns as Stats.report()."""
+    if approximation not in APPROXIMATIONS:
+        raise ValueError(f'unknown approximation {approximation!r}')
+    if model is None:
+        model = Model()
+    rng = model.rng
+    fluid = approximation == 'fluid'
+    capacity = Bus().capacity
+    world = build_world(model, routes, stops, passengers, length,
+                        fleet_size, route_seed)
+    rate, proba, distance, traffic = route_arrays(world.routes)
+    K, S = rate.shape
+    rate, proba = rate.reshape(-1) * step, proba.reshape(-1)
+
+    def dwell_time(count, mean_std):
+        mean, std = mean_std
+        if fluid:
+            return count * mean
+        return np.maximum(0, count * mean + np.sqrt(count) * std
+                          * rng.standard_normal(count.size))
+
+    def board(buses, since):
+        # everyone waiting boards, buses at the same stop in turn, and
+        # is counted on board from since minutes before the step's end
+        place = route[buses] * S + stop[buses]
+        order = np.argsort(place, kind='stable')
+        buses, place, since = buses[order], place[order], since[order]
+        room = capacity - load[buses]
+        taken = np.cumsum(room) - room
+        _places, first, counts = np.unique(place, return_index=True,
+                                           return_counts=True)
+        taken -= np.repeat(taken[first], counts)
+        boarded = np.clip(waiting[place] - taken, 0, room)
+        np.subtract.at(waiting, place, boarded)
+        load[buses] += boarded
+        carried[buses] += boarded
+        passenger_time[buses] += boarded * since
+        return buses, boarded
+
+    # every direction's buses leave on its own schedule; the first
+    # fleet_size trips are taken by the buses starting on it
+    schedule = np.arange(0, duration * 2, headway, dtype=float)
+    first_trips = min(fleet_size, schedule.size)
+    next_slot = np.full(K, first_trips)
+    start = np.zeros(fleet_size)
+    start[:first_trips] = schedule[:first_trips]
+
+    # fleet state; remaining is the travel time left to the next stop
+    # and work the dwell time left at the current one, both negative
+    # once passed, by the time since
+    route = np.repeat(np.arange(K), fleet_size)
+    B = route.size
+    stop = np.zeros(B, dtype=np.int64)
+    start = np.tile(start, K)
+    remaining = start + travel_time(model, distance[route, 0],
+                                    traffic[route, 0], rng.standard_normal(B))
+    dwelling = np.zeros(B, dtype=bool)
+    work = np.zeros(B)
+    load = np.zeros(B, dtype=np.int64)
+    carried = np.zeros(B, dtype=np.int64)
+    passenger_time = np.zeros(B)
+    waiting = np.zeros(K * S, dtype=np.int64)
+
+    # statistics, as kept by the Stats simulate() uses, with headways on
+    # the first direction
+    total_time = total_passengers = 0
+    completions = last_completion = headway_sum = 0
+    trips = trip_length_sum = leaps = 0
+    last_bus = np.zeros(K)
+
+    t = 0.0
+    while True:
+        t += step
+        waiting += rng.poisson(rate)
+        passenger_time += load * step
+        remaining[~dwelling] -= step
+        work[dwelling] -= step
+        arrived = np.flatnonzero(~dwelling & (remaining <= 0))
+        # stop at the first bus to begin a trip after the end of the
+        # simulation
+        if (start[arrived] >= duration).any():
+            break
+
+        if arrived.size:
+            end = arrived[stop[arrived] == S - 1]
+            for b in end[np.argsort(remaining[end])]:
+                when = t + remaining[b]
+                # time on board after arrival counts toward the next trip
+                total_time += passenger_time[b] + load[b] * remaining[b]
+                passenger_time[b] = -load[b] * remaining[b]
+                total_passengers += carried[b]
+                carried[b] = 0
+                if route[b] == 0:
+                    completions += 1
+                    headway_sum += when - last_completion
+                    last_completion = when
+                trips += 1
+                trip_length_sum += when - start[b]
+                leaps += start[b] < last_bus[route[b]]
+                last_bus[route[b]] = start[b]
+
+            arrived = arrived[np.argsort(route[arrived] * S
+                                         + stop[arrived], kind='stable')]
+            p = proba[route[arrived] * S + stop[arrived]]
+            if fluid:
+                alighted = np.floor(load[arrived] * p
+                                    + rng.random(arrived.size))
+                alighted = alighted.astype(np.int64)
+            else:
+                alighted = rng.binomial(load[arrived], p)
+            load[arrived] -= alighted
+            passenger_time[arrived] += alighted * remaining[arrived]
+            # arrived is in stop order, so board() keeps its order
+            _buses, boarded = board(arrived, -remaining[arrived])
+            work[arrived] = (remaining[arrived]
+                             + dwell_time(alighted, model.unloading_time)
+                             + dwell_time(boarded, model.loading_time))
+            dwelling[arrived] = True
+
+        # top-ups: buses whose dwell has ended board everyone who
+        # arrived since, and leave if there is no one
+        ready = np.flatnonzero(dwelling & (work <= 0))
+        if not ready.size:
+            continue
+        ready, boarded = board(ready, -work[ready])
+        work[ready] += dwell_time(boarded, model.loading_time)
+        departing = ready[boarded == 0]
+        if not departing.size:
+            continue
+
+        # departures, at the end of their dwell
+        leave = t + work[departing]
+        k, s = route[departing], stop[departing]
+        turn = s == S - 1
+        for i in np.flatnonzero(turn):
+            nk = k[i] ^ 1
+            if next_slot[nk] < schedule.size:
+                leave[i] = max(leave[i], schedule[next_slot[nk]])
+                next_slot[nk] += 1
+            start[departing[i]] = leave[i]
+        k = np.where(turn, k ^ 1, k)
+        s = np.where(turn, 0, s + 1)
+        route[departing], stop[departing] = k, s
+        remaining[departing] = leave - t + travel_time(
+            model, distance[k, s], traffic[k, s],
+            rng.standard_normal(departing.size))
+        work[departing] = 0
+        dwelling[departing] = False
+
+    return pd.Series(
+            {'total_time': total_time,
+             'total_passengers': total_passengers,
+             'mean_travel_time': (total_time / total_passengers
+                                  if total_passengers else np.nan),
+             'total_completions': completions,
+             'trip_lengths': trip_length_sum / trips if trips else np.nan,
+             'leaps': leaps,
+             'mean_wait': (headway_sum / completions if completions
+                           else np.nan)
+            })
+
+
+def accuracy(replications=20, duration=60*12, model=None, step=.5,
+             approximation='binomial', seed=None, level=.95, **params):
+    """Run replications of a scenario with both the exact event engine
+    and the leaping engine, each on generators spawned from seed, and
+    return the mean of every statistic under each engine, their
+    difference, the half-width of a confidence interval for the
+    difference and the relative difference."""
+    if model is None:
+        model = Model()
+    children = np.random.SeedSequence(seed).spawn(2 * replications)
+    exact = pd.DataFrame([
+        simulate(duration, model.with_rng(np.random.default_rng(child)),
+                 **params)
+        for child in children[:replications]])
+    leaping = pd.DataFrame([
+        simulate_leaping(duration,
+                         model.with_rng(np.random.default_rng(child)),
+                         step, approximation, **params)
+        for child in children[replications:]])
+    exact_ci = confidence(exact, level)
+    leaping_ci = confidence(leaping, level)
+    difference = leaping_ci.loc['theta'] - exact_ci.loc['theta']
+    return pd.DataFrame(
+            {'exact': exact_ci.loc['theta'],
+             'leaping': leaping_ci.loc['theta'],
+             'difference': difference,
+             'confidence': np.sqrt(exact_ci.loc['confidence']**2
+                                   + leaping_ci.loc['confidence']**2),
+             'relative': difference / exact_ci.loc['theta']})
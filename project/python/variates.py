@@ -0,0 +1,140 @@
+"""Block-buffered random variates.
+
+Drawing a handful of variates from numpy costs far more in call overhead
+than in generation, and the event simulation draws a few variates per
+event. A VariatePool draws standard normals and uniforms from a numpy
+random number generator in large blocks, keeps them as Python floats,
+and hands them out one at a time or as slices. Poisson variates with
+small means are generated by inversion from pooled uniforms; other
+poisson and all binomial variates come straight from the generator,
+since a single numpy call is cheaper than inversion in Python, unless
+the pool is asked to invert every variate. An antithetic pool hands out
+the mirror image (1 - u and -z) of the stream drawn from its generator,
+so runs on a plain and an antithetic pool built from the same seed are
+negatively correlated. The pool provides the subset of the numpy
+Generator interface used by the simulation, so it can stand in for a
+Generator wherever a model, stop or bus draws variates. A pool built on
+a seeded generator always produces the same stream."""
+
+from math import exp
+
+
+class VariatePool:
+    """Pools of standard normal and uniform variates drawn from rng in
+    blocks of a given size and refilled as they run out. If inversion
+    is set, every poisson and binomial variate is generated by
+    inversion, so that each is a monotone function of one pooled
+    uniform; antithetic pools always invert."""
+    # inversion takes time proportional to the mean, so variates with
+    # larger means are cheaper to draw from the generator directly
+    max_inversion_mean = 4
+    # exp(-mean) underflows beyond this
+    max_exact_inversion_mean = 700
+
+    def __init__(self, rng, block=4096, inversion=False, antithetic=False):
+        self.rng = rng
+        self.block = block
+        self.inversion = inversion or antithetic
+        self.antithetic = antithetic
+        self._normals, self._next_normal = [], 0
+        self._uniforms, self._next_uniform = [], 0
+
+    def _draw_normals(self, size):
+        normals = self.rng.standard_normal(size)
+        return (-normals if self.antithetic else normals).tolist()
+
+    def _draw_uniforms(self, size):
+        uniforms = self.rng.random(size)
+        return (1 - uniforms if self.antithetic else uniforms).tolist()
+
+    def standard_normals(self, size):
+        """Returns a list of size standard normal variates."""
+        start, stop = self._next_normal, self._next_normal + size
+        if stop > len(self._normals):
+            self._normals = (self._normals[start:]
+                             + self._draw_normals(max(self.block, size)))
+            start, stop = 0, size
+        self._next_normal = stop
+        return self._normals[start:stop]
+
+    def uniforms(self, size):
+        """Returns a list of size uniform variates on [0, 1)."""
+        start, stop = self._next_uniform, self._next_uniform + size
+        if stop > len(self._uniforms):
+            self._uniforms = (self._uniforms[start:]
+                              + self._draw_uniforms(max(self.block, size)))
+            start, stop = 0, size
+        self._next_uniform = stop
+        return self._uniforms[start:stop]
+
+    def standard_normal(self):
+        """Returns a single standard normal variate."""
+        if self._next_normal == len(self._normals):
+            self._normals = self._draw_normals(self.block)
+            self._next_normal = 0
+        self._next_normal += 1
+        return self._normals[self._next_normal - 1]
+
+    def random(self):
+        """Returns a single uniform variate on [0, 1)."""
+        if self._next_uniform == len(self._uniforms):
+            self._uniforms = self._draw_uniforms(self.block)
+            self._next_uniform = 0
+        self._next_uniform += 1
+        return self._uniforms[self._next_uniform - 1]
+
+    def normal(self, loc=0.0, scale=1.0, size=None):
+        """Returns a normal variate, or a list of size of them."""
+        if size is None:
+            return loc + scale * self.standard_normal()
+        return [loc + scale * z for z in self.standard_normals(size)]
+
+    def uniform(self, low=0.0, high=1.0, size=None):
+        """Returns a uniform variate on [low, high), or a list of size of
+        them."""
+        if size is None:
+            return low + (high - low) * self.random()
+        return [low + (high - low) * u for u in self.uniforms(size)]
+
+    def poisson(self, lam):
+        """Returns a poisson variate with mean lam."""
+        if lam > (self.max_exact_inversion_mean if self.inversion
+                  else self.max_inversion_mean):
+            return self.rng.poisson(lam)
+        u = self.random()
+        k = 0
+        prob = cumulative = exp(-lam)
+        while u >= cumulative and prob > 0:
+            k += 1
+            prob *= lam / k
+            cumulative += prob
+        return k
+
+    def binomial(self, n, p):
+        """Returns a binomial variate with n trials and probability p."""
+        if not self.inversion:
+            return self.rng.binomial(n, p)
+        if n <= 0 or p <= 0:
+            return 0
+        if p >= 1:
+            return n
+        u = self.random()
+        if p > .5:
+            # invert on the failures, whose starting term p**n underflows
+            # far later than (1 - p)**n; with 1 - u, so that the variate
+            # still increases with u
+            return n - self._invert_binomial(n, 1 - p, 1 - u)
+        return self._invert_binomial(n, p, u)
+
+    def _invert_binomial(self, n, p, u):
+        # p <= .5, so (1 - p)**n only underflows for n beyond about 1000
+        prob = cumulative = (1 - p) ** n
+        if prob == 0:
+            return self.rng.binomial(n, p)
+        k = 0
+        odds = p / (1 - p)
+        while u >= cumulative and k < n:
+            prob *= odds * (n - k) / (k + 1)
+            k += 1
+            cumulative += prob
+        return k